@@ -0,0 +1,229 @@
+import asyncio
+import math
+import os
+from contextlib import asynccontextmanager
+
+import httpx
+import openai
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import chat_gpt
+import metrics
+import storage
+from scheduler import SchedulerError, scheduler
+from telegram_queue import OVERLOADED
+
+# Native-async serving mode:
+#   gunicorn -w 4 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:10000 asgi:app
+# Each worker keeps one AsyncOpenAI client whose httpx pool is reused by
+# every request, so a worker can hold hundreds of chats waiting on OpenAI.
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "256"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))  # seconds
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))  # seconds
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))  # seconds
+
+
+@asynccontextmanager
+async def lifespan(app):
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    )
+    chat_gpt.async_client = openai.AsyncOpenAI(
+        api_key=chat_gpt.OPENAI_API_KEY, http_client=http_client, max_retries=0
+    )
+    chat_gpt.openai_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    # Telegram updates are handled on this worker's event loop
+    chat_gpt.update_queue.attach(asyncio.get_running_loop())
+    try:
+        yield
+    finally:
+        await chat_gpt.async_client.close()
+        chat_gpt.async_client = None
+        chat_gpt.openai_slots = None
+        storage.writer.flush()
+
+
+def route_label(path: str) -> str:
+    # Keeps user ids out of the metric labels
+    if path.startswith("/history/"):
+        return "/history/<user_id>"
+    return path if path in ROUTE_PATHS else "other"
+
+
+class RequestMetrics:
+    # Counts requests per route and status, and tracks requests in flight.
+    # Streamed responses count until the last chunk has been sent.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = route_label(scope["path"])
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        metrics.inc("chatbot_requests_in_flight", {"route": route})
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.inc("chatbot_requests_in_flight", {"route": route}, -1)
+            metrics.inc("chatbot_requests_total", {"route": route, "status": str(status["code"])})
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+async def telegram_webhook(request):
+    try:
+        data = await read_json(request)
+        with metrics.stage("parse"):
+            update = chat_gpt.parse_telegram_update(data, request.headers.get("x-telegram-bot-api-secret-token"))
+    except PermissionError as e:
+        print(f"Webhook error: {e}")
+        return PlainTextResponse("Forbidden", status_code=403)
+    except Exception as e:
+        print(f"Webhook error: {e}")
+        return PlainTextResponse("Error", status_code=400)
+    # submit() may claim the update_id in SQLite, so keep it off the loop
+    if update is not None and await asyncio.to_thread(chat_gpt.update_queue.submit, update) == OVERLOADED:
+        # Shed load; Telegram redelivers the update later
+        return PlainTextResponse("Busy", status_code=503)
+    return PlainTextResponse("OK", status_code=200)
+
+
+async def home(request):
+    return FileResponse(os.path.join(os.path.dirname(__file__), "templates", "index.html"))
+
+
+async def favicon(request):
+    return Response(status_code=204)
+
+
+async def robots(request):
+    return PlainTextResponse("""
+    User-agent: *
+    Disallow: /
+    """, status_code=200)
+
+
+async def chat(request):
+    try:
+        with metrics.stage("parse"):
+            data = await read_json(request) or {}
+            user_id = data.get("user_id") or chat_gpt.ANONYMOUS_USER
+            user_message = data.get("message")
+
+        if not user_message:
+            return JSONResponse({"error": "No message provided"}, status_code=400)
+
+        usage = {}
+        bot_response = await chat_gpt.chat_with_gpt(user_message, user_id, usage=usage)
+
+        await chat_gpt.arecord_turn(user_id, user_message, bot_response, usage)
+
+        return JSONResponse({"response": bot_response})
+    except SchedulerError as e:
+        headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after is not None else None
+        return JSONResponse(chat_gpt.scheduler_error_body(e), status_code=e.status, headers=headers)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def chat_stream(request):
+    with metrics.stage("parse"):
+        data = await read_json(request) or {}
+        user_id = data.get("user_id") or chat_gpt.ANONYMOUS_USER
+        user_message = data.get("message")
+
+    if not user_message:
+        return JSONResponse({"error": "No message provided"}, status_code=400)
+
+    return StreamingResponse(
+        chat_gpt.asse_chat_events(user_id, user_message),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def metrics_endpoint(request):
+    # Prometheus text format, aggregated across workers; reads snapshot files
+    body = await asyncio.to_thread(metrics.render)
+    return Response(body, media_type="text/plain; version=0.0.4")
+
+
+async def cache_stats(request):
+    # Counters are per worker
+    if chat_gpt.response_cache is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse(dict(chat_gpt.response_cache.stats(), enabled=True, pid=os.getpid()))
+
+
+async def scheduler_stats(request):
+    # Counters are per worker
+    return JSONResponse(dict(scheduler.stats(), pid=os.getpid()))
+
+
+async def get_history(request):
+    user_id = request.path_params["user_id"]
+    try:
+        limit, before = chat_gpt.history_params(request.query_params.get("limit"), request.query_params.get("before"))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    etag, cache_control = await asyncio.to_thread(chat_gpt.history_validators, user_id, limit, before)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if f'"{etag}"' in if_none_match or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    # SQLite connections are per thread, so the (bounded) page is encoded in
+    # one worker thread rather than iterated across the threadpool
+    body = await asyncio.to_thread(lambda: "".join(chat_gpt.history_json(user_id, limit, before)))
+    return Response(body, media_type="application/json", headers=headers)
+
+
+routes = [
+    Route("/telegram", telegram_webhook, methods=["POST"]),
+    Route("/", home, methods=["GET"]),
+    Route("/favicon.ico", favicon, methods=["GET"]),
+    Route("/robots.txt", robots, methods=["GET"]),
+    Route("/chat", chat, methods=["POST"]),
+    Route("/chat/stream", chat_stream, methods=["POST"]),
+    Route("/cache/stats", cache_stats, methods=["GET"]),
+    Route("/scheduler/stats", scheduler_stats, methods=["GET"]),
+    Route("/history/{user_id}", get_history, methods=["GET"]),
+    Route("/metrics", metrics_endpoint, methods=["GET"]),
+]
+ROUTE_PATHS = {route.path for route in routes}
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(RequestMetrics),
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+    ],
+    lifespan=lifespan,
+)
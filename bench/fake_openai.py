@@ -0,0 +1,175 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Serves POST /v1/chat/completions, plain or streamed, with configurable
+latency, error injection and x-ratelimit-* headers. Standard library only,
+so the benchmark runs fully offline.
+
+    python bench/fake_openai.py --port 18001 --latency 0.8 --stream-interval 0.02
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_WORDS = "Γεια σου! Είμαι ένας βοηθός δοκιμών και απαντώ με σταθερό κείμενο.".split()
+
+
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def enter(self, stream: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            self.streams += stream
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def reset_peak(self) -> None:
+        with self.lock:
+            self.max_in_flight = self.in_flight
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "streams": self.streams, "errors": self.errors,
+                    "in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+
+
+def make_handler(args, stats):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *values):
+            pass
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._json(200, stats.as_dict())
+            elif self.path == "/stats/reset":
+                stats.reset_peak()
+                self._json(200, stats.as_dict())
+            else:
+                self._json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            stream = bool(body.get("stream"))
+            stats.enter(stream)
+            try:
+                self._complete(body, stream)
+            finally:
+                stats.leave()
+
+        def _complete(self, body, stream):
+            if random.random() < args.error_rate:
+                with stats.lock:
+                    stats.errors += 1
+                time.sleep(args.latency / 4)
+                status = random.choice([429, 500, 503])
+                self._json(status, {"error": {"message": "injected failure", "code": status}},
+                           {"retry-after-ms": "200"} if status == 429 else None)
+                return
+
+            words = [random.choice(REPLY_WORDS) for _ in range(args.tokens)]
+            usage = {"prompt_tokens": sum(len(m.get("content", "")) // 4 + 1 for m in body.get("messages", [])),
+                     "completion_tokens": len(words)}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            headers = self._ratelimit_headers()
+            created = int(time.time())
+            model = body.get("model", "gpt-3.5-turbo")
+
+            if not stream:
+                time.sleep(max(0.0, random.gauss(args.latency, args.jitter)))
+                self._json(200, {
+                    "id": "chatcmpl-bench", "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": " ".join(words)}}],
+                    "usage": usage,
+                }, headers)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            time.sleep(max(0.0, random.gauss(args.ttft, args.jitter)))
+            for i, word in enumerate(words):
+                chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created,
+                         "model": model, "choices": [{"index": 0, "delta": {"content": (" " if i else "") + word},
+                                                      "finish_reason": None}]}
+                self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+                time.sleep(args.stream_interval)
+            final = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            self._chunk(f"data: {json.dumps(final)}\n\n")
+            self._chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _ratelimit_headers(self):
+            # Remaining capacity shrinks with load so adaptive clients react
+            with stats.lock:
+                in_flight = stats.in_flight
+            remaining = max(0, args.rpm_limit - in_flight * args.rpm_per_request)
+            return {"x-ratelimit-limit-requests": str(args.rpm_limit),
+                    "x-ratelimit-remaining-requests": str(remaining),
+                    "x-ratelimit-reset-requests": "1s"}
+
+        def _chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _json(self, status, payload, headers=None):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18001)
+    parser.add_argument("--latency", type=float, default=0.8, help="seconds for a non-streamed reply")
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first streamed token")
+    parser.add_argument("--stream-interval", type=float, default=0.02, help="seconds between streamed tokens")
+    parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of latency, seconds")
+    parser.add_argument("--tokens", type=int, default=30, help="tokens per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing 429/5xx")
+    parser.add_argument("--rpm-limit", type=int, default=10000)
+    parser.add_argument("--rpm-per-request", type=int, default=10,
+                        help="remaining-requests consumed per in-flight request")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, Stats()))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Local stand-in for the Telegram Bot API.
+
+Answers POST /bot<token>/<method> for the methods the bot uses
+(sendMessage, editMessageText, setWebhook, getMe) and counts calls and
+finished replies, so Telegram replies can be measured without network
+access. A reply is finished once a message gets text that is not the
+streaming placeholder; --fallback texts are also counted separately.
+
+    python bench/fake_telegram.py --port 18002
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class Stats:
+
+    def __init__(self, placeholder: str, fallbacks: list):
+        self.lock = threading.Lock()
+        self.placeholder = placeholder
+        self.fallbacks = set(fallbacks)
+        self.calls = {}
+        self.chats_replied = set()
+        self.replies = 0
+        self.fallback_replies = 0
+
+    def record(self, method: str, chat_id, text: str) -> None:
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method not in ("sendMessage", "editMessageText"):
+                return
+            if text == self.placeholder or text.endswith(" " + self.placeholder):
+                return  # placeholder or streaming preview
+            self.chats_replied.add(chat_id)
+            self.replies += 1
+            if text in self.fallbacks:
+                self.fallback_replies += 1
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {"calls": dict(self.calls), "chats_replied": len(self.chats_replied),
+                    "replies": self.replies, "fallback_replies": self.fallback_replies}
+
+
+def make_handler(args, stats):
+    message_ids = itertools.count(1)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *values):
+            pass
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._json(200, stats.as_dict())
+            else:
+                self._json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length).decode("utf-8")
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(raw or "{}")
+            else:
+                params = {k: v[0] for k, v in parse_qs(raw).items()}
+            method = self.path.rsplit("/", 1)[-1]
+            time.sleep(args.latency)
+
+            if method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            elif method in ("setWebhook", "deleteWebhook"):
+                result = True
+            elif method in ("sendMessage", "editMessageText"):
+                chat_id = int(params.get("chat_id", 0))
+                message_id = int(params.get("message_id") or next(message_ids))
+                result = {"message_id": message_id, "date": int(time.time()),
+                          "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+                if method == "editMessageText":
+                    result["edit_date"] = int(time.time())
+            else:
+                self._json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                return
+            stats.record(method, params.get("chat_id"), params.get("text", ""))
+            self._json(200, {"ok": True, "result": result})
+
+        def _json(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18002)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Bot API call")
+    parser.add_argument("--placeholder", default="…", help="text of a streamed reply not yet finished")
+    parser.add_argument("--fallback", action="append", default=[], help="error reply text to count")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, Stats(args.placeholder, args.fallback)))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""Offline load benchmark for chat_gpt.py.
+
+Starts the local OpenAI and Telegram stand-ins, launches the app through
+start.sh (gunicorn, WSGI or ASGI mode) against a throwaway database, then
+drives /chat, /chat/stream, /telegram and /history at each concurrency
+level and reports p50/p95/p99 latency, requests per second, error rates
+and SQLite contention seen in the server log.
+
+    python bench/run.py --concurrency 1,16,64 --duration 20
+    python bench/run.py --mode asgi --workers 2 --scenarios chat,stream --json bench.json
+
+Needs the app's requirements installed (gunicorn, httpx, ...); no network
+access or API keys.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# App settings for benchmarking; the per-user limits would otherwise
+# throttle the synthetic users. Override with --app-env KEY=VALUE.
+BENCH_ENV = {
+    "OPENAI_API_KEY": "bench",
+    "TELEGRAM_BOT_TOKEN": "123456:bench",
+    "SCHED_USER_RATE": "1000",
+    "SCHED_USER_BURST": "1000",
+    "TELEGRAM_EDIT_INTERVAL": "0.2",
+}
+
+CONTENTION_MARKERS = ("database is locked", "Database write error")
+
+
+def app_constants(*names) -> dict:
+    # Reads string constants from chat_gpt.py without importing the app
+    with open(os.path.join(REPO_DIR, "chat_gpt.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and getattr(node.targets[0], "id", None) in names:
+            values[node.targets[0].id] = ast.literal_eval(node.value)
+    return values
+
+
+APP = app_constants("ERROR_MESSAGE", "BUSY_MESSAGE", "TELEGRAM_PLACEHOLDER")
+# A 200 carrying one of these is still a failed turn
+FALLBACK_REPLIES = (APP["ERROR_MESSAGE"], APP["BUSY_MESSAGE"])
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def wait_for(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+class Result:
+
+    def __init__(self, scenario: str, concurrency: int):
+        self.scenario = scenario
+        self.concurrency = concurrency
+        self.latencies = []
+        self.first_byte = []
+        self.errors = 0
+        # Telegram: updates acknowledged but never answered, or answered
+        # with a fallback, once the replies have drained
+        self.unanswered = 0
+        self.fallback_replies = 0
+        self.elapsed = 0.0
+        self.extra = {}
+
+    def summary(self) -> dict:
+        total = len(self.latencies) + self.errors
+        failed = self.errors + self.unanswered + self.fallback_replies
+        succeeded = len(self.latencies) - self.unanswered - self.fallback_replies
+        summary = {
+            "scenario": self.scenario,
+            "concurrency": self.concurrency,
+            "requests": total,
+            "rps": succeeded / self.elapsed if self.elapsed else 0.0,
+            "error_rate": failed / total if total else 0.0,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p95_ms": percentile(self.latencies, 95) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+        }
+        if self.scenario == "telegram":
+            summary["unanswered"] = self.unanswered
+            summary["fallback_replies"] = self.fallback_replies
+        if self.first_byte:
+            summary["ttft_p50_ms"] = percentile(self.first_byte, 50) * 1000
+            summary["ttft_p95_ms"] = percentile(self.first_byte, 95) * 1000
+        summary.update(self.extra)
+        return summary
+
+
+class Driver:
+
+    def __init__(self, args, base_url: str):
+        self.args = args
+        self.base_url = base_url
+        self.counter = 0
+        self.update_id = 1000
+
+    def next_request(self):
+        self.counter += 1
+        user = f"bench_{self.counter % self.args.users}"
+        # Unique text keeps the response cache out of the way unless asked for
+        message = "Γεια σου!" if self.args.cacheable else f"Μήνυμα δοκιμής {self.counter}"
+        return user, message
+
+    async def chat(self, client, result):
+        user, message = self.next_request()
+        response = await client.post("/chat", json={"user_id": user, "message": message})
+        return response.status_code == 200 and response.json().get("response") not in FALLBACK_REPLIES
+
+    async def stream(self, client, result):
+        user, message = self.next_request()
+        started = time.perf_counter()
+        first = True
+        done = False
+        async with client.stream("POST", "/chat/stream", json={"user_id": user, "message": message}) as response:
+            if response.status_code != 200:
+                return False
+            async for line in response.aiter_lines():
+                if first and line.startswith("data:"):
+                    result.first_byte.append(time.perf_counter() - started)
+                    first = False
+                if line == "event: done":
+                    done = True
+        return done
+
+    async def telegram(self, client, result):
+        user, message = self.next_request()
+        self.update_id += 1
+        chat_id = 10000 + self.counter % self.args.users
+        update = {
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": user},
+                "text": message,
+            },
+        }
+        response = await client.post("/telegram", json=update)
+        return response.status_code == 200
+
+    async def history(self, client, result):
+        user, _ = self.next_request()
+        response = await client.get(f"/history/{user}", params={"limit": 50})
+        return response.status_code in (200, 304)
+
+    async def run_level(self, scenario: str, concurrency: int) -> Result:
+        result = Result(scenario, concurrency)
+        request = getattr(self, scenario)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        timeout = httpx.Timeout(self.args.timeout)
+        deadline = time.perf_counter() + self.args.duration
+
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout) as client:
+            async def worker():
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        ok = await request(client, result)
+                    except httpx.HTTPError:
+                        ok = False
+                    if ok:
+                        result.latencies.append(time.perf_counter() - started)
+                    else:
+                        result.errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            result.elapsed = time.perf_counter() - started
+        return result
+
+
+def count_contention(log_path: str) -> int:
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    return sum(text.count(marker) for marker in CONTENTION_MARKERS)
+
+
+def telegram_stats(telegram_url: str) -> dict:
+    return httpx.get(f"{telegram_url}/stats", timeout=5).json()
+
+
+def wait_for_replies(telegram_url: str, before: dict, expected: int, timeout: float):
+    # Telegram updates are acknowledged before they are answered; wait until
+    # the stand-in has seen a finished reply for each one. Returns the time
+    # waited, the updates still unanswered at the deadline and the replies
+    # that were a fallback.
+    started = time.monotonic()
+    while True:
+        stats = telegram_stats(telegram_url)
+        replies = stats["replies"] - before["replies"]
+        if replies >= expected or time.monotonic() - started >= timeout:
+            break
+        time.sleep(0.2)
+    fallbacks = stats["fallback_replies"] - before["fallback_replies"]
+    return time.monotonic() - started, max(0, expected - replies), fallbacks
+
+
+def start(cmd, log, env=None, cwd=None):
+    return subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env, cwd=cwd, start_new_session=True)
+
+
+def stop(proc) -> None:
+    if proc.poll() is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def print_report(summaries: list) -> None:
+    columns = ["scenario", "concurrency", "requests", "rps", "error_rate", "p50_ms", "p95_ms", "p99_ms",
+               "ttft_p50_ms", "db_contention", "upstream_max_in_flight", "reply_drain_s", "unanswered",
+               "fallback_replies"]
+    print(" ".join(f"{c:>14}" for c in columns))
+    for summary in summaries:
+        cells = []
+        for c in columns:
+            value = summary.get(c, "")
+            if isinstance(value, float):
+                value = f"{value:.3f}" if c == "error_rate" else f"{value:.1f}"
+            cells.append(f"{value:>14}")
+        print(" ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers (start.sh default: 4)")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated levels")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per level")
+    parser.add_argument("--scenarios", default="chat,stream,telegram,history")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--cacheable", action="store_true", help="repeat one prompt to exercise the cache")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--openai-ttft", type=float, default=0.3)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory (db, logs)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    openai_port, telegram_port = args.port + 1, args.port + 2
+    openai_url = f"http://127.0.0.1:{openai_port}"
+    telegram_url = f"http://127.0.0.1:{telegram_port}"
+    base_url = f"http://127.0.0.1:{args.port}"
+    server_log = os.path.join(workdir, "server.log")
+
+    env = dict(os.environ, **BENCH_ENV)
+    env.update({
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "TELEGRAM_API_URL": f"{telegram_url}/bot",
+        "CHATBOT_DB": os.path.join(workdir, "bench.db"),
+        # start.sh clears this; keep a live server's snapshots out of reach
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+        "SERVER_MODE": args.mode,
+        "WEB_CONCURRENCY": str(args.workers),
+        "PORT": str(args.port),
+        "PYTHONUNBUFFERED": "1",
+    })
+    for item in args.app_env:
+        key, value = item.split("=", 1)
+        env[key] = value
+
+    procs = []
+    try:
+        with open(os.path.join(workdir, "fakes.log"), "w") as fakes_log, open(server_log, "w") as log:
+            procs.append(start([sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"),
+                                "--port", str(openai_port),
+                                "--latency", str(args.openai_latency),
+                                "--ttft", str(args.openai_ttft),
+                                "--error-rate", str(args.openai_error_rate)], fakes_log))
+            procs.append(start([sys.executable, os.path.join(BENCH_DIR, "fake_telegram.py"),
+                                "--port", str(telegram_port),
+                                "--latency", str(args.telegram_latency),
+                                "--placeholder", APP["TELEGRAM_PLACEHOLDER"],
+                                *[arg for text in FALLBACK_REPLIES for arg in ("--fallback", text)]],
+                               fakes_log))
+            wait_for(f"{openai_url}/stats", 10)
+            wait_for(f"{telegram_url}/stats", 10)
+            procs.append(start(["bash", os.path.join(REPO_DIR, "start.sh")], log, env=env, cwd=REPO_DIR))
+            wait_for(f"{base_url}/robots.txt", 30)
+
+            driver = Driver(args, base_url)
+            summaries = []
+            for scenario in args.scenarios.split(","):
+                for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                    contention = count_contention(server_log)
+                    before = telegram_stats(telegram_url)
+                    httpx.get(f"{openai_url}/stats/reset")
+                    result = asyncio.run(driver.run_level(scenario, concurrency))
+                    if scenario == "telegram":
+                        drain, result.unanswered, result.fallback_replies = wait_for_replies(
+                            telegram_url, before, len(result.latencies), args.timeout)
+                        result.extra["reply_drain_s"] = drain
+                    result.extra["db_contention"] = count_contention(server_log) - contention
+                    result.extra["upstream_max_in_flight"] = httpx.get(f"{openai_url}/stats").json()["max_in_flight"]
+                    summary = result.summary()
+                    summaries.append(summary)
+                    print(f"{scenario} x{concurrency}: {summary['rps']:.1f} rps, "
+                          f"p95 {summary['p95_ms']:.0f} ms, errors {summary['error_rate']:.1%}", file=sys.stderr)
+
+        print_report(summaries)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"mode": args.mode, "workers": args.workers, "results": summaries}, f, indent=2)
+    finally:
+        for proc in reversed(procs):
+            stop(proc)
+        if args.keep:
+            print(f"Logs and database kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
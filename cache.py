@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+
+# Response cache settings
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+# Shared tier in SQLite so every gunicorn worker sees the same hits
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "1") == "1"
+# Expired shared entries are deleted at most this often
+RESPONSE_CACHE_PRUNE_INTERVAL = float(os.getenv("RESPONSE_CACHE_PRUNE_INTERVAL", "300"))
+
+
+def normalize_prompt(text: str) -> str:
+    # "Γεια σου!" and "  γεια   σου! " should hit the same entry
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(model: str, messages: list, max_tokens: int, temperature: float) -> str:
+    payload = json.dumps(
+        {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": [
+                {"role": m["role"], "content": normalize_prompt(m["content"])}
+                for m in messages
+            ],
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # In-process LRU with TTL in front of an optional SQLite-backed tier.
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 shared: bool = RESPONSE_CACHE_SHARED):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.entries = OrderedDict()  # key -> (response, expires_at)
+        self.lock = threading.Lock()
+        self.last_prune = time.time()
+        self.counts = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self.entries.move_to_end(key)
+                    self.counts["hits"] += 1
+                    return entry[0]
+                del self.entries[key]
+                self.counts["expirations"] += 1
+
+        if self.shared:
+            try:
+                row = storage.get_cached_response(key, now)
+            except Exception as e:
+                print(f"Response cache read error: {e}")
+                row = None
+            if row is not None:
+                with self.lock:
+                    self.counts["shared_hits"] += 1
+                    self._store(key, row[0], row[1])
+                return row[0]
+
+        with self.lock:
+            self.counts["misses"] += 1
+        return None
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.lock:
+            self._store(key, response, expires_at)
+        if self.shared:
+            try:
+                storage.put_cached_response(key, response, expires_at)
+                if now - self.last_prune >= RESPONSE_CACHE_PRUNE_INTERVAL:
+                    self.last_prune = now
+                    storage.prune_response_cache(now)
+            except Exception as e:
+                print(f"Response cache write error: {e}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counts, entries=len(self.entries), max_entries=self.max_entries)
+
+    def _store(self, key: str, response: str, expires_at: float) -> None:
+        # Caller holds self.lock
+        self.entries[key] = (response, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counts["evictions"] += 1
+
+
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
@@ -1,88 +1,533 @@
 import openai
-import sqlite3
 import os
 import json
-from flask import Flask, request, jsonify,render_template
+import hashlib
+import math
+import time
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g
 from flask_cors import CORS
 from telegram import Update, Bot
 from telegram.ext import Application, MessageHandler, filters, CommandHandler
+from telegram.request import HTTPXRequest
 import asyncio
+from contextlib import nullcontext
+import storage
+import metrics
+from cache import cache_key, response_cache
+from telegram_queue import TELEGRAM_WORKERS, UpdateQueue, OVERLOADED
+from scheduler import SchedulerError, scheduler
+from context import CONTEXT_ENABLED, CONTEXT_SUMMARY_MAX_TOKENS, SUMMARY_PROMPT, ContextCache
 
 app = Flask(__name__)
 CORS(app)
 
-# Database setup
-conn = sqlite3.connect("chatbot.db", check_same_thread=False)
-cursor = conn.cursor()
-
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS conversations (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        user_message TEXT NOT NULL,
-        bot_response TEXT NOT NULL,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-""")
-conn.commit()
+@app.before_request
+def track_request_start():
+    g.metrics_route = request.url_rule.rule if request.url_rule else "other"
+    metrics.inc("chatbot_requests_in_flight", {"route": g.metrics_route})
+
+@app.after_request
+def track_request_status(response):
+    metrics.inc("chatbot_requests_total", {"route": g.get("metrics_route", "other"), "status": str(response.status_code)})
+    return response
+
+@app.teardown_request
+def track_request_end(exc):
+    # For streamed responses this runs once the stream has finished
+    route = g.pop("metrics_route", None)
+    if route is not None:
+        metrics.inc("chatbot_requests_in_flight", {"route": route}, -1)
+
+# Database setup (WAL mode, per-thread connections, write-behind inserts)
+storage.init_db()
 
 # API Keys
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 WEBHOOK_URL = "https://chat-gpt-c9pz.onrender.com/telegram"
+# Bot API endpoint; bench/ points this at a local stand-in
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+# Optional; Telegram echoes it in X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# Seconds a Bot API call may wait for a free pooled connection
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "5"))
+
+# OpenAI completion parameters
+OPENAI_MODEL = "gpt-3.5-turbo"
+MAX_TOKENS = 150
+TEMPERATURE = 0.7
+
+# Telegram streaming: send a placeholder and edit it as tokens arrive.
+# Telegram rate-limits message edits, so they are throttled.
+TELEGRAM_STREAM_REPLIES = os.getenv("TELEGRAM_STREAM_REPLIES", "1") == "1"
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.0"))
+TELEGRAM_PLACEHOLDER = "…"
+
+ERROR_MESSAGE = "Συγγνώμη, προέκυψε ένα σφάλμα."
+BUSY_MESSAGE = "Ο βοηθός είναι απασχολημένος αυτή τη στιγμή. Δοκίμασε ξανά σε λίγο."
+
+# Requests without a user_id are stored under this id. The callers behind
+# it are unrelated, so it gets no conversation context and no per-user
+# rate limit.
+ANONYMOUS_USER = "guest"
+
+# History pagination
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
 
 if not OPENAI_API_KEY or not TELEGRAM_BOT_TOKEN:
     raise ValueError("Missing API keys!")
 
-# Initialize clients
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+# Initialize clients (retries are handled by the scheduler)
+client = openai.OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+# One pooled connection per chat the update queue handles in parallel;
+# python-telegram-bot defaults to a single connection for all of them
+bot = Bot(
+    token=TELEGRAM_BOT_TOKEN,
+    base_url=TELEGRAM_API_URL,
+    request=HTTPXRequest(connection_pool_size=TELEGRAM_WORKERS, pool_timeout=TELEGRAM_POOL_TIMEOUT)
+)
+application = Application.builder().bot(bot).build()
 
-async def chat_with_gpt(user_input: str) -> str:
-    try:
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-3.5-turbo",  # Changed to valid model name
-            messages=[{"role": "user", "content": user_input}],
-            max_tokens=150,
-            temperature=0.7
-        )
+# ASGI mode (asgi.py) replaces these with one long-lived AsyncOpenAI client
+# per worker and a semaphore capping in-flight upstream calls; the scheduler
+# applies its own adaptive limit on top. Under WSGI every request runs in a
+# fresh event loop, so the sync client is used from a thread instead.
+async_client = None
+openai_slots = None
+
+def openai_slot():
+    return openai_slots if openai_slots is not None else nullcontext()
+
+def summarize_turns(summary: str, turns: list) -> str:
+    # Folds turns that left the context budget into the rolling summary.
+    # Runs in a context.py worker thread, so the sync client is used.
+    lines = [f"Προηγούμενη σύνοψη: {summary}"] if summary else []
+    for user_message, bot_response in turns:
+        lines.append(f"Χρήστης: {user_message}")
+        lines.append(f"Βοηθός: {bot_response}")
+    create = lambda: client.chat.completions.with_raw_response.create(
+        model=OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": "\n".join(lines)}
+        ],
+        max_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+        temperature=0.3
+    )
+    started = time.perf_counter()
+    with scheduler.call(create, None, "summary") as response:
+        record_usage(None, response, started)
         return response.choices[0].message.content.strip()
+
+# Recent turns per user, kept within a token budget
+context_cache = ContextCache(summarize_turns, skip_responses=(ERROR_MESSAGE,)) if CONTEXT_ENABLED else None
+
+def known_user(user_id: str):
+    # None for anonymous callers
+    return None if not user_id or user_id == ANONYMOUS_USER else user_id
+
+def completion_request(user_input: str, user_id: str = None):
+    # Returns the messages to send and their response cache key. Replies to
+    # a conversation with history are not cached (key None): the key would
+    # cover the whole history, so they would almost never hit and each miss
+    # would still cost a shared-tier read.
+    if context_cache is not None and known_user(user_id) is not None:
+        messages = context_cache.messages(user_id, user_input)
+    else:
+        messages = [{"role": "user", "content": user_input}]
+    if len(messages) > 1:
+        return messages, None
+    return messages, cache_key(OPENAI_MODEL, messages, MAX_TOKENS, TEMPERATURE)
+
+def record_turn(user_id: str, user_message: str, bot_response: str, usage: dict = None) -> None:
+    # usage: model, prompt/completion tokens and upstream latency of the turn
+    storage.save_conversation(user_id, user_message, bot_response, **(usage or {}))
+    if context_cache is not None and known_user(user_id) is not None:
+        context_cache.record_turn(user_id, user_message, bot_response)
+
+async def arecord_turn(user_id: str, user_message: str, bot_response: str, usage: dict = None) -> None:
+    # record_turn may load the user's context from SQLite; keep it off the loop
+    await asyncio.to_thread(record_turn, user_id, user_message, bot_response, usage)
+
+def prepare_request(user_input: str, user_id: str = None):
+    # Messages, cache key and cached reply (or None) for a turn. May read
+    # SQLite (context or shared cache miss), so async code runs it in a thread.
+    messages, key = completion_request(user_input, user_id)
+    return messages, key, cached_reply(key)
+
+def cached_reply(key: str):
+    if response_cache is None or key is None:
+        return None
+    return response_cache.get(key)
+
+def cache_reply(key: str, bot_response: str) -> None:
+    if response_cache is not None and key is not None and bot_response:
+        response_cache.put(key, bot_response)
+
+def completion_kwargs(messages: list, stream: bool = False) -> dict:
+    kwargs = dict(model=OPENAI_MODEL, messages=messages, max_tokens=MAX_TOKENS, temperature=TEMPERATURE)
+    if stream:
+        kwargs["stream"] = True
+        # The last chunk then carries the token usage
+        kwargs["stream_options"] = {"include_usage": True}
+    return kwargs
+
+def record_usage(usage: dict, response, started: float) -> None:
+    # Records the OpenAI stage latency and token counters, and fills the
+    # per-turn usage dict (if given) for record_turn
+    elapsed = time.perf_counter() - started
+    metrics.observe("chatbot_stage_seconds", elapsed, {"stage": "openai"})
+    response_usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(response_usage, "prompt_tokens", None)
+    completion_tokens = getattr(response_usage, "completion_tokens", None)
+    if prompt_tokens:
+        metrics.inc("chatbot_tokens_total", {"type": "prompt"}, prompt_tokens)
+    if completion_tokens:
+        metrics.inc("chatbot_tokens_total", {"type": "completion"}, completion_tokens)
+    if usage is not None:
+        usage.update(
+            model=getattr(response, "model", None) or OPENAI_MODEL,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            upstream_latency_ms=elapsed * 1000
+        )
+
+def record_cache_hit(usage: dict) -> None:
+    if usage is not None:
+        usage.update(model=OPENAI_MODEL, prompt_tokens=0, completion_tokens=0)
+
+def completion_create(messages: list, stream: bool = False):
+    # Coroutine function for scheduler.acall. Under WSGI the sync client runs
+    # in a thread, but the wait for a slot stays on the event loop: threads
+    # parked on the scheduler would starve the streams that hold a slot of
+    # the executor threads they need to finish.
+    kwargs = completion_kwargs(messages, stream)
+    if async_client is not None:
+        return lambda: async_client.chat.completions.with_raw_response.create(**kwargs)
+    return lambda: asyncio.to_thread(client.chat.completions.with_raw_response.create, **kwargs)
+
+async def stream_chunks(stream):
+    # Iterates either client's stream; the sync client's reads run in a thread
+    if hasattr(stream, "__aiter__"):
+        async for chunk in stream:
+            yield chunk
+        return
+    chunks = iter(stream)
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            break
+        yield chunk
+
+async def chat_with_gpt(user_input: str, user_id: str = None, channel: str = "web", usage: dict = None) -> str:
+    # Scheduler rejections (rate limit, overload, open circuit) are raised so
+    # callers can report them; other upstream errors give ERROR_MESSAGE.
+    messages, key, cached = await asyncio.to_thread(prepare_request, user_input, user_id)
+    if cached is not None:
+        record_cache_hit(usage)
+        return cached
+    try:
+        started = time.perf_counter()
+        async with openai_slot():
+            async with scheduler.acall(completion_create(messages), known_user(user_id), channel) as response:
+                record_usage(usage, response, started)
+                bot_response = response.choices[0].message.content.strip()
+    except SchedulerError:
+        raise
     except Exception as e:
         print(f"OpenAI API error: {e}")
-        return "Συγγνώμη, προέκυψε ένα σφάλμα."
+        metrics.inc("chatbot_upstream_failures_total")
+        return ERROR_MESSAGE
+    if key is not None:
+        await asyncio.to_thread(cache_reply, key, bot_response)
+    return bot_response
+
+def stream_chat_with_gpt(user_input: str, user_id: str = None, channel: str = "web", usage: dict = None):
+    # Yields the completion text delta by delta as OpenAI produces it.
+    # Errors are raised to the caller, which decides how to report them.
+    # A cached reply is yielded as a single delta.
+    messages, key, cached = prepare_request(user_input, user_id)
+    if cached is not None:
+        record_cache_hit(usage)
+        yield cached
+        return
+    create = lambda: client.chat.completions.with_raw_response.create(**completion_kwargs(messages, stream=True))
+    parts = []
+    last_chunk = None
+    started = time.perf_counter()
+    with scheduler.call(create, known_user(user_id), channel) as stream:
+        for chunk in stream:
+            last_chunk = chunk
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    record_usage(usage, last_chunk, started)
+    cache_reply(key, "".join(parts).strip())
+
+async def astream_chat_with_gpt(user_input: str, user_id: str = None, channel: str = "web", usage: dict = None):
+    # Async counterpart of stream_chat_with_gpt, for the ASGI app and the
+    # Telegram queue (with the sync client under WSGI)
+    messages, key, cached = await asyncio.to_thread(prepare_request, user_input, user_id)
+    if cached is not None:
+        record_cache_hit(usage)
+        yield cached
+        return
+    parts = []
+    last_chunk = None
+    started = time.perf_counter()
+    async with openai_slot():
+        async with scheduler.acall(completion_create(messages, stream=True), known_user(user_id), channel) as stream:
+            async for chunk in stream_chunks(stream):
+                last_chunk = chunk
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+    record_usage(usage, last_chunk, started)
+    if key is not None:
+        await asyncio.to_thread(cache_reply, key, "".join(parts).strip())
+
+def scheduler_error_body(e: SchedulerError) -> dict:
+    body = {"error": BUSY_MESSAGE, "status": e.reason}
+    if e.retry_after is not None:
+        body["retry_after"] = math.ceil(e.retry_after)
+    return body
+
+def sse_event(data: dict, event: str = None) -> str:
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        payload = f"event: {event}\n" + payload
+    return payload
+
+def sse_chat_events(user_id: str, user_message: str):
+    # Server-Sent Events: one "data" event per token delta, then a "done"
+    # event carrying the full reply. The reply is stored once the stream ends.
+    parts = []
+    usage = {}
+    try:
+        for delta in stream_chat_with_gpt(user_message, user_id, usage=usage):
+            parts.append(delta)
+            yield sse_event({"delta": delta})
+        bot_response = "".join(parts).strip() or ERROR_MESSAGE
+        yield sse_event({"response": bot_response}, event="done")
+    except SchedulerError as e:
+        # Never reached OpenAI; nothing to store
+        yield sse_event(scheduler_error_body(e), event="error")
+        return
+    except Exception as e:
+        print(f"OpenAI API error: {e}")
+        metrics.inc("chatbot_upstream_failures_total")
+        bot_response = ERROR_MESSAGE
+        yield sse_event({"error": bot_response}, event="error")
+    record_turn(user_id, user_message, bot_response, usage)
+
+async def asse_chat_events(user_id: str, user_message: str):
+    # Async counterpart of sse_chat_events, used by the ASGI app
+    parts = []
+    usage = {}
+    try:
+        async for delta in astream_chat_with_gpt(user_message, user_id, usage=usage):
+            parts.append(delta)
+            yield sse_event({"delta": delta})
+        bot_response = "".join(parts).strip() or ERROR_MESSAGE
+        yield sse_event({"response": bot_response}, event="done")
+    except SchedulerError as e:
+        # Never reached OpenAI; nothing to store
+        yield sse_event(scheduler_error_body(e), event="error")
+        return
+    except Exception as e:
+        print(f"OpenAI API error: {e}")
+        metrics.inc("chatbot_upstream_failures_total")
+        bot_response = ERROR_MESSAGE
+        yield sse_event({"error": bot_response}, event="error")
+    await arecord_turn(user_id, user_message, bot_response, usage)
+
+def history_params(limit: str = None, before: str = None):
+    # Parses the /history query; raises ValueError with the message for a 400
+    try:
+        limit = HISTORY_PAGE_SIZE if limit is None else int(limit)
+    except ValueError:
+        raise ValueError("Invalid limit")
+    try:
+        before = None if before is None else int(before)
+    except ValueError:
+        raise ValueError("Invalid before")
+    if limit < 1:
+        raise ValueError("Invalid limit")
+    return min(limit, HISTORY_MAX_PAGE_SIZE), before
+
+def history_validators(user_id: str, limit: int, before: int = None):
+    # Returns (etag, cache_control) for a history page
+    latest_id = storage.latest_history_id(user_id, before)
+    etag = hashlib.sha1(f"{user_id}:{before}:{limit}:{latest_id}".encode("utf-8")).hexdigest()
+    # A page ending below one of the user's rows never changes (ids only
+    # grow); the newest page, or one past the newest row, must be revalidated
+    settled = before is not None and before <= (storage.latest_history_id(user_id) or 0)
+    cache_control = "private, max-age=86400" if settled else "private, no-cache"
+    return etag, cache_control
+
+def history_json(user_id: str, limit: int, before: int = None):
+    # Encode row by row so the whole page is never held in memory
+    rows = storage.fetch_history(user_id, limit, before)
+    yield "["
+    for i, row in enumerate(rows):
+        item = {"id": row[0], "user": row[1], "bot": row[2], "timestamp": row[3]}
+        yield ("," if i else "") + json.dumps(item, ensure_ascii=False)
+    yield "]"
+
+async def telegram_reply(send, text: str):
+    # send is a bound reply_text/edit_text; timed as the telegram_reply stage
+    with metrics.stage("telegram_reply"):
+        return await send(text)
+
+async def edit_preview(message, text: str) -> None:
+    # Intermediate edits are best effort: one that fails (flood control,
+    # message not modified, ...) is skipped and the reply carries on
+    try:
+        await telegram_reply(message.edit_text, text + " " + TELEGRAM_PLACEHOLDER)
+    except Exception as e:
+        print(f"Telegram edit error: {e}")
+
+async def stream_telegram_reply(update: Update, user_id: str, user_message: str, usage: dict = None) -> str:
+    # Sends a placeholder message and edits it while the completion streams
+    # in. The edits run in their own task, at most one per
+    # TELEGRAM_EDIT_INTERVAL and always with the latest text, so a slow
+    # Telegram call never holds up the stream or its OpenAI slot.
+    # Returns the full reply text.
+    message = await telegram_reply(update.message.reply_text, TELEGRAM_PLACEHOLDER)
+    parts = []
+    changed = asyncio.Event()
+    finished = asyncio.Event()
+
+    async def edit_previews():
+        shown = ""
+        while True:
+            try:
+                await asyncio.wait_for(finished.wait(), TELEGRAM_EDIT_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                pass
+            await changed.wait()
+            changed.clear()
+            text = "".join(parts).strip()
+            if text and text != shown and not finished.is_set():
+                shown = text
+                await edit_preview(message, text)
+
+    editor = asyncio.create_task(edit_previews())
+    try:
+        async for delta in astream_chat_with_gpt(user_message, user_id, "telegram", usage):
+            parts.append(delta)
+            changed.set()
+        text = "".join(parts).strip()
+    except SchedulerError:
+        await telegram_reply(message.edit_text, BUSY_MESSAGE)
+        raise
+    except Exception as e:
+        print(f"OpenAI API error: {e}")
+        metrics.inc("chatbot_upstream_failures_total")
+        text = ERROR_MESSAGE
+    finally:
+        # Lets an edit in flight finish, so it cannot land after the final one
+        finished.set()
+        changed.set()
+        await editor
+    if not text:
+        text = ERROR_MESSAGE
+    try:
+        await telegram_reply(message.edit_text, text)
+    except Exception as e:
+        # The reply is still stored; send it as a new message instead
+        print(f"Telegram edit error: {e}")
+        await telegram_reply(update.message.reply_text, text)
+    return text
 
 async def handle_message(update: Update, context) -> None:
     try:
         user_message = update.message.text
         user_id = str(update.message.chat_id)
+        usage = {}
         
-        # Get response from GPT
-        bot_response = await chat_with_gpt(user_message)
+        if TELEGRAM_STREAM_REPLIES:
+            # Stream the reply into a placeholder message
+            bot_response = await stream_telegram_reply(update, user_id, user_message, usage)
+        else:
+            # Get response from GPT and send it in one piece
+            bot_response = await chat_with_gpt(user_message, user_id, "telegram", usage)
+            await telegram_reply(update.message.reply_text, bot_response)
         
         # Save to database
-        cursor.execute(
-            "INSERT INTO conversations (user_id, user_message, bot_response) VALUES (?, ?, ?)",
-            (user_id, user_message, bot_response)
-        )
-        conn.commit()
-        
-        # Send response
-        await update.message.reply_text(bot_response)
+        await arecord_turn(user_id, user_message, bot_response, usage)
+    except SchedulerError as e:
+        # Never reached OpenAI; nothing to store
+        print(f"Scheduler rejected message ({e.reason}): {e}")
+        if not TELEGRAM_STREAM_REPLIES:
+            await telegram_reply(update.message.reply_text, BUSY_MESSAGE)
     except Exception as e:
         print(f"Error in handle_message: {e}")
-        await update.message.reply_text("Συγγνώμη, προέκυψε ένα σφάλμα.")
+        await telegram_reply(update.message.reply_text, ERROR_MESSAGE)
+
+# Updates are acknowledged immediately and handled in the background, so a
+# slow completion no longer makes Telegram time out and redeliver
+update_queue = UpdateQueue(handle_message)
+
+def collect_metrics():
+    # Per-worker state read when metrics are snapshotted
+    stats = scheduler.stats()
+    samples = [
+        ("chatbot_upstream_in_flight", None, stats["in_flight"]),
+        ("chatbot_upstream_queued", None, stats["queued"]),
+        ("chatbot_upstream_concurrency_limit", None, stats["limit"]),
+        ("chatbot_circuit_open", None, 0 if stats["state"] == "closed" else 1),
+        ("chatbot_upstream_errors_total", None, stats["upstream_errors"]),
+        ("chatbot_upstream_retries_total", None, stats["retries"]),
+        ("chatbot_telegram_queue_pending", None, update_queue.pending),
+    ]
+    for reason in ("rate_limited", "overloaded", "circuit_open"):
+        samples.append(("chatbot_scheduler_rejections_total", {"reason": reason}, stats[reason]))
+    if response_cache is not None:
+        cache_stats = response_cache.stats()
+        for result in ("hits", "shared_hits", "misses", "evictions", "expirations"):
+            samples.append(("chatbot_response_cache_total", {"result": result}, cache_stats[result]))
+    return samples
+
+metrics.add_collector(collect_metrics)
+
+def parse_telegram_update(data, secret_token):
+    # Returns the update to enqueue, or None if it should be ignored
+    if TELEGRAM_WEBHOOK_SECRET and secret_token != TELEGRAM_WEBHOOK_SECRET:
+        raise PermissionError("Invalid webhook secret token")
+    if not isinstance(data, dict):
+        raise ValueError("Invalid update payload")
+    update = Update.de_json(data, bot)
+    if update is None or update.message is None or not update.message.text:
+        return None
+    return update
 
 @app.route("/telegram", methods=["POST"])
-async def telegram_webhook():
+def telegram_webhook():
     try:
-        update = Update.de_json(request.get_json(), bot)
-        await handle_message(update, None)
-        return "OK", 200
+        with metrics.stage("parse"):
+            update = parse_telegram_update(
+                request.get_json(silent=True),
+                request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+            )
+    except PermissionError as e:
+        print(f"Webhook error: {e}")
+        return "Forbidden", 403
     except Exception as e:
         print(f"Webhook error: {e}")
-        return "Error", 500
+        return "Error", 400
+    if update is not None and update_queue.submit(update) == OVERLOADED:
+        # Shed load; Telegram redelivers the update later
+        return "Busy", 503
+    return "OK", 200
 
 @app.route("/", methods=["GET"])
 def home():
@@ -104,38 +549,87 @@ def robots():
 @app.route("/chat", methods=["POST"])
 async def chat():
     try:
-        data = request.json
-        user_id = data.get("user_id", "guest")
-        user_message = data.get("message")
+        with metrics.stage("parse"):
+            data = request.json
+            user_id = data.get("user_id") or ANONYMOUS_USER
+            user_message = data.get("message")
         
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
-            
-        bot_response = await chat_with_gpt(user_message)
         
-        cursor.execute(
-            "INSERT INTO conversations (user_id, user_message, bot_response) VALUES (?, ?, ?)",
-            (user_id, user_message, bot_response)
-        )
-        conn.commit()
+        usage = {}
+        bot_response = await chat_with_gpt(user_message, user_id, usage=usage)
+        
+        record_turn(user_id, user_message, bot_response, usage)
         
         return jsonify({"response": bot_response})
+    except SchedulerError as e:
+        response = jsonify(scheduler_error_body(e))
+        response.status_code = e.status
+        if e.retry_after is not None:
+            response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    with metrics.stage("parse"):
+        data = request.get_json(silent=True) or {}
+        user_id = data.get("user_id") or ANONYMOUS_USER
+        user_message = data.get("message")
+    
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+    
+    return Response(
+        stream_with_context(sse_chat_events(user_id, user_message)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    # Prometheus text format, aggregated across gunicorn workers
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    # Counters are per gunicorn worker
+    if response_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(response_cache.stats(), enabled=True, pid=os.getpid()))
+
+@app.route("/scheduler/stats", methods=["GET"])
+def scheduler_stats():
+    # Counters are per gunicorn worker
+    return jsonify(dict(scheduler.stats(), pid=os.getpid()))
+
 @app.route("/history/<user_id>", methods=["GET"])
 def get_history(user_id):
-    cursor.execute(
-        "SELECT user_message, bot_response, timestamp FROM conversations WHERE user_id = ? ORDER BY timestamp DESC",
-        (user_id,)
-    )
-    chats = cursor.fetchall()
-    chat_list = [{"user": row[0], "bot": row[1], "timestamp": row[2]} for row in chats]
-    return jsonify(chat_list)
+    # Keyset pagination: newest first, `limit` rows per page; pass the id of
+    # the oldest row received as `before` to get the previous page.
+    try:
+        limit, before = history_params(request.args.get("limit"), request.args.get("before"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    etag, cache_control = history_validators(user_id, limit, before)
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+        return response
+    
+    response = Response(stream_with_context(history_json(user_id, limit, before)), mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
 
 async def setup():
     # Set webhook
-    await bot.set_webhook(WEBHOOK_URL)
+    await bot.set_webhook(WEBHOOK_URL, secret_token=TELEGRAM_WEBHOOK_SECRET)
     # Add message handler
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
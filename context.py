@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Multi-turn context settings
+CONTEXT_ENABLED = os.getenv("CONTEXT_ENABLED", "1") == "1"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))  # recent turns
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "200"))
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "50"))  # rows loaded on a cache miss
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "1000"))  # users per worker
+# Other workers may have added turns, so cached contexts are reloaded after this
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "300"))  # seconds
+
+SUMMARY_PROMPT = (
+    "Ενημέρωσε τη σύνοψη της συνομιλίας με τις νέες ανταλλαγές. "
+    "Κράτησε μόνο ό,τι χρειάζεται για να συνεχιστεί η συζήτηση, σύντομα."
+)
+
+
+if tiktoken is not None:
+    _encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+else:
+    def count_tokens(text: str) -> int:
+        # Rough estimate without tiktoken; Greek text runs about 3 chars a token
+        return len(text) // 3 + 1
+
+
+class UserContext:
+
+    def __init__(self, summary: str = ""):
+        self.summary = summary
+        self.turns = deque()  # (user_message, bot_response, tokens), oldest first
+        self.tokens = 0
+        self.overflow = []  # turns pushed out of the budget, not yet summarized
+        self.summarizing = False
+        self.loaded_at = time.monotonic()
+
+    def add_turn(self, user_message: str, bot_response: str, tokens: int = None) -> None:
+        if tokens is None:
+            tokens = count_tokens(user_message) + count_tokens(bot_response)
+        self.turns.append((user_message, bot_response, tokens))
+        self.tokens += tokens
+        while self.tokens > CONTEXT_TOKEN_BUDGET and len(self.turns) > 1:
+            turn = self.turns.popleft()
+            self.tokens -= turn[2]
+            self.overflow.append(turn[:2])
+
+    def messages(self) -> list:
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Σύνοψη προηγούμενης συνομιλίας: {self.summary}"})
+        for user_message, bot_response, _ in self.turns:
+            messages.append({"role": "user", "content": user_message})
+            messages.append({"role": "assistant", "content": bot_response})
+        return messages
+
+
+class ContextCache:
+    # Per-user conversation context kept in memory (LRU), so the hot path
+    # neither re-queries nor re-tokenizes history. Turns that fall out of the
+    # token budget are folded into a rolling summary in the background.
+
+    def __init__(self, summarize, size: int = CONTEXT_CACHE_SIZE, ttl: float = CONTEXT_CACHE_TTL,
+                 skip_responses=()):
+        # summarize(summary, turns) -> new summary; called from a worker thread.
+        # skip_responses: stored fallback replies that are not part of the
+        # conversation (e.g. the error message).
+        self.summarize = summarize
+        self.skip_responses = frozenset(skip_responses)
+        self.size = size
+        self.ttl = ttl
+        self.contexts = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+
+    def messages(self, user_id: str, user_message: str) -> list:
+        ctx = self._get(user_id)
+        with self.lock:
+            messages = ctx.messages()
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def record_turn(self, user_id: str, user_message: str, bot_response: str) -> None:
+        if bot_response in self.skip_responses:
+            return
+        ctx = self._get(user_id)
+        with self.lock:
+            ctx.add_turn(user_message, bot_response)
+            if not ctx.overflow or ctx.summarizing:
+                return
+            ctx.summarizing = True
+        self.executor.submit(self._summarize, user_id, ctx)
+
+    def _get(self, user_id: str) -> UserContext:
+        with self.lock:
+            ctx = self.contexts.get(user_id)
+            if ctx is not None and time.monotonic() - ctx.loaded_at < self.ttl:
+                self.contexts.move_to_end(user_id)
+                return ctx
+        ctx = self._load(user_id)
+        with self.lock:
+            self.contexts[user_id] = ctx
+            self.contexts.move_to_end(user_id)
+            while len(self.contexts) > self.size:
+                self.contexts.popitem(last=False)
+        return ctx
+
+    def _load(self, user_id: str) -> UserContext:
+        ctx = UserContext(storage.load_summary(user_id) or "")
+        turns = []
+        tokens = 0
+        for _, user_message, bot_response, _ in storage.fetch_history(user_id, CONTEXT_MAX_TURNS):
+            if bot_response in self.skip_responses:
+                continue
+            turn_tokens = count_tokens(user_message) + count_tokens(bot_response)
+            if tokens + turn_tokens > CONTEXT_TOKEN_BUDGET:
+                break
+            turns.append((user_message, bot_response, turn_tokens))
+            tokens += turn_tokens
+        for user_message, bot_response, turn_tokens in reversed(turns):
+            ctx.add_turn(user_message, bot_response, turn_tokens)
+        return ctx
+
+    def _summarize(self, user_id: str, ctx: UserContext) -> None:
+        while True:
+            with self.lock:
+                turns = ctx.overflow
+                ctx.overflow = []
+                summary = ctx.summary
+                if not turns:
+                    ctx.summarizing = False
+                    return
+            try:
+                summary = self.summarize(summary, turns)
+            except Exception as e:
+                # Includes scheduler refusals; the turns wait for the next try
+                print(f"Context summary error: {e}")
+                with self.lock:
+                    ctx.overflow[:0] = turns
+                    ctx.summarizing = False
+                return
+            with self.lock:
+                ctx.summary = summary
+            storage.save_summary(user_id, summary)
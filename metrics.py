@@ -0,0 +1,221 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Each gunicorn worker keeps its own metrics and writes a snapshot to
+# METRICS_DIR every METRICS_FLUSH_INTERVAL seconds; /metrics, served by any
+# worker, merges all snapshots. start.sh clears the directory on deploy.
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "chatbot-metrics"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0"))  # seconds
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help)
+METRICS = {
+    "chatbot_stage_seconds": ("histogram", "Time spent per stage: parse, openai, db_write, telegram_reply."),
+    "chatbot_requests_total": ("counter", "HTTP requests by route and status code."),
+    "chatbot_requests_in_flight": ("gauge", "HTTP requests currently being served, by route."),
+    "chatbot_tokens_total": ("counter", "OpenAI tokens used, by type (prompt or completion)."),
+    "chatbot_upstream_failures_total": ("counter", "Chat turns answered with the error fallback."),
+    "chatbot_upstream_errors_total": ("counter", "Retryable OpenAI errors (429, 5xx, connection)."),
+    "chatbot_upstream_retries_total": ("counter", "OpenAI calls retried after an error."),
+    "chatbot_scheduler_rejections_total": ("counter", "Requests refused by the scheduler, by reason."),
+    "chatbot_upstream_in_flight": ("gauge", "OpenAI calls in progress."),
+    "chatbot_upstream_queued": ("gauge", "OpenAI calls waiting for a scheduler slot."),
+    "chatbot_upstream_concurrency_limit": ("gauge", "Adaptive OpenAI concurrency limit."),
+    "chatbot_circuit_open": ("gauge", "Workers whose OpenAI circuit breaker is not closed."),
+    "chatbot_response_cache_total": ("counter", "Response cache lookups and evictions, by result."),
+    "chatbot_telegram_queue_pending": ("gauge", "Telegram updates accepted but not yet handled."),
+}
+
+GAUGES = {name for name, (kind, _) in METRICS.items() if kind == "gauge"}
+
+
+def _key(name: str, labels: dict) -> str:
+    return json.dumps([name, sorted((labels or {}).items())])
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # key -> counter or gauge value
+        self.histograms = {}  # key -> [bucket counts..., sum, count]
+        self.collectors = []
+
+    def inc(self, name: str, labels: dict = None, value: float = 1.0) -> None:
+        key = _key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, labels: dict = None) -> None:
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def add_collector(self, collect) -> None:
+        # collect() -> [(name, labels, value)], read at snapshot time
+        self.collectors.append(collect)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.values = {}
+            self.histograms = {}
+
+    def snapshot(self) -> dict:
+        values = {}
+        for collect in self.collectors:
+            try:
+                for name, labels, value in collect():
+                    values[_key(name, labels)] = value
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        with self.lock:
+            values.update(self.values)
+            histograms = {key: list(h) for key, h in self.histograms.items()}
+        return {"pid": os.getpid(), "values": values, "histograms": histograms}
+
+
+registry = Registry()
+_flusher = {"pid": None}
+_flusher_lock = threading.Lock()
+
+
+def inc(name: str, labels: dict = None, value: float = 1.0) -> None:
+    _ensure_flusher()
+    registry.inc(name, labels, value)
+
+
+def observe(name: str, seconds: float, labels: dict = None) -> None:
+    _ensure_flusher()
+    registry.observe(name, seconds, labels)
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("chatbot_stage_seconds", time.perf_counter() - started, {"stage": name})
+
+
+def add_collector(collect) -> None:
+    registry.add_collector(collect)
+
+
+def _ensure_flusher() -> None:
+    # Threads do not survive fork, so each worker starts its own flusher.
+    # Values recorded before the fork belong to the parent's snapshot.
+    if _flusher["pid"] == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher["pid"] == os.getpid():
+            return
+        if _flusher["pid"] is not None:
+            registry.reset()
+        _flusher["pid"] = os.getpid()
+        threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Metrics flush error: {e}")
+
+
+def flush() -> None:
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _snapshots() -> list:
+    # This worker's live values plus every other worker's last snapshot.
+    # Counters of exited workers are kept so totals never go backwards;
+    # their gauges are dropped.
+    snapshots = [registry.snapshot()]
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if not name.endswith(".json") or name == f"{os.getpid()}.json":
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not _alive(snapshot["pid"]):
+            snapshot["values"] = {k: v for k, v in snapshot["values"].items() if json.loads(k)[0] not in GAUGES}
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _format_labels(labels, extra=None) -> str:
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def render() -> str:
+    # Prometheus text exposition format, summed across workers
+    values = {}
+    histograms = {}
+    for snapshot in _snapshots():
+        for key, value in snapshot["values"].items():
+            values[key] = values.get(key, 0.0) + value
+        for key, histogram in snapshot["histograms"].items():
+            total = histograms.setdefault(key, [0] * len(histogram))
+            for i, v in enumerate(histogram):
+                total[i] += v
+
+    samples = {}
+    for key, value in sorted(values.items()):
+        name, labels = json.loads(key)
+        samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value:g}")
+    for key, histogram in sorted(histograms.items()):
+        name, labels = json.loads(key)
+        lines = samples.setdefault(name, [])
+        cumulative = histogram[:len(BUCKETS)]  # observe() already counts cumulatively
+        for bound, count in zip(BUCKETS, cumulative):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]:g}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+
+    output = []
+    for name in sorted(samples):
+        kind, help_text = METRICS.get(name, ("untyped", ""))
+        output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(samples[name])
+    return "\n".join(output) + "\n"
@@ -0,0 +1,390 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import openai
+
+# Admission control and fair scheduling for upstream OpenAI calls (per worker)
+SCHED_USER_RATE = float(os.getenv("SCHED_USER_RATE", "0.5"))  # requests per second per user
+SCHED_USER_BURST = float(os.getenv("SCHED_USER_BURST", "5"))
+SCHED_MAX_QUEUE = int(os.getenv("SCHED_MAX_QUEUE", "500"))
+SCHED_QUEUE_TIMEOUT = float(os.getenv("SCHED_QUEUE_TIMEOUT", "30"))  # seconds
+# Weighted fair queuing: each (channel, user) is a flow; heavier channels get
+# a larger share when upstream capacity is contended.
+SCHED_CHANNEL_WEIGHTS = os.getenv("SCHED_CHANNEL_WEIGHTS", "web=1,telegram=1,summary=0.5")
+# Adaptive concurrency, driven by the x-ratelimit-* response headers
+SCHED_INITIAL_CONCURRENCY = float(os.getenv("SCHED_INITIAL_CONCURRENCY", "16"))
+SCHED_MIN_CONCURRENCY = float(os.getenv("SCHED_MIN_CONCURRENCY", "1"))
+SCHED_MAX_CONCURRENCY = float(os.getenv("SCHED_MAX_CONCURRENCY", "256"))
+SCHED_LOW_WATERMARK = float(os.getenv("SCHED_LOW_WATERMARK", "0.1"))  # fraction of limit remaining
+# Retries on 429/5xx/connection errors, with full-jitter exponential backoff
+SCHED_MAX_RETRIES = int(os.getenv("SCHED_MAX_RETRIES", "3"))
+SCHED_BACKOFF_BASE = float(os.getenv("SCHED_BACKOFF_BASE", "0.5"))  # seconds
+SCHED_BACKOFF_MAX = float(os.getenv("SCHED_BACKOFF_MAX", "8"))  # seconds
+# Circuit breaker
+SCHED_BREAKER_THRESHOLD = int(os.getenv("SCHED_BREAKER_THRESHOLD", "5"))  # consecutive failures
+SCHED_BREAKER_COOLDOWN = float(os.getenv("SCHED_BREAKER_COOLDOWN", "30"))  # seconds
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class SchedulerError(Exception):
+    # A request refused before (or instead of) reaching OpenAI
+    status = 503
+    reason = "unavailable"
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimited(SchedulerError):
+    status = 429
+    reason = "rate_limited"
+
+
+class Overloaded(SchedulerError):
+    status = 503
+    reason = "overloaded"
+
+
+class CircuitOpen(SchedulerError):
+    status = 503
+    reason = "upstream_unavailable"
+
+
+def parse_weights(spec: str) -> dict:
+    weights = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, weight = item.split("=", 1)
+            weights[name.strip()] = float(weight)
+    return weights
+
+
+def parse_reset(value: str) -> float:
+    # OpenAI reset headers look like "1s", "6m0s" or "120ms"
+    seconds = 0.0
+    number = ""
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c.isdigit() or c == ".":
+            number += c
+        elif value.startswith("ms", i):
+            seconds += float(number or 0) / 1000
+            number = ""
+            i += 1
+        elif c in "hms":
+            seconds += float(number or 0) * {"h": 3600, "m": 60, "s": 1}[c]
+            number = ""
+        i += 1
+    return seconds
+
+
+class Ticket:
+
+    def __init__(self, finish: float, seq: int, flow, loop=None):
+        self.finish = finish
+        self.seq = seq
+        self.flow = flow
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+        self.cancelled = False
+        self.probe = False
+
+    def __lt__(self, other):
+        return (self.finish, self.seq) < (other.finish, other.seq)
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Scheduler:
+    # Thread-safe so the same instance serves sync threads (WSGI, summaries)
+    # and coroutines on any event loop (ASGI, Telegram queue).
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.weights = parse_weights(SCHED_CHANNEL_WEIGHTS)
+        self.buckets = {}  # user_id -> [tokens, last refill]
+        self.last_finish = {}  # flow -> virtual finish time of its last request
+        self.virtual_time = 0.0
+        self.queue = []  # heap of tickets ordered by virtual finish time
+        self.seq = itertools.count()
+        self.limit = SCHED_INITIAL_CONCURRENCY
+        self.in_flight = 0
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.counts = {"admitted": 0, "rate_limited": 0, "overloaded": 0, "circuit_open": 0,
+                       "retries": 0, "upstream_errors": 0}
+
+    # -- public API --------------------------------------------------------
+
+    @contextmanager
+    def call(self, create, user_id: str, channel: str):
+        # Runs create() (a with_raw_response call) under a slot, retrying
+        # transient failures. Yields the parsed result; the slot is held
+        # until the block exits, so streams count against concurrency.
+        attempt = 0
+        while True:
+            ticket = self._admit(user_id, channel, charge=attempt == 0)
+            self._wait(ticket)
+            try:
+                raw = create()
+            except Exception as e:
+                delay = self._failed(ticket, e, attempt)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self._cancelled(ticket)
+                raise
+            self._succeeded(ticket, raw.headers)
+            try:
+                yield raw.parse()
+            finally:
+                self._release()
+            return
+
+    @asynccontextmanager
+    async def acall(self, create, user_id: str, channel: str):
+        # Async counterpart of call(); create is a coroutine function
+        attempt = 0
+        while True:
+            ticket = self._admit(user_id, channel, charge=attempt == 0, loop=asyncio.get_running_loop())
+            await self._await(ticket)
+            try:
+                raw = await create()
+            except Exception as e:
+                delay = self._failed(ticket, e, attempt)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # CancelledError is not an Exception; the slot must still be freed
+                self._cancelled(ticket)
+                raise
+            self._succeeded(ticket, raw.headers)
+            try:
+                yield raw.parse()
+            finally:
+                self._release()
+            return
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counts, state=self.state, limit=self.limit,
+                        in_flight=self.in_flight, queued=len(self.queue))
+
+    # -- admission and queuing ---------------------------------------------
+
+    def _admit(self, user_id, channel, charge=True, loop=None) -> Ticket:
+        now = time.monotonic()
+        with self.lock:
+            probe = self._check_breaker(now)
+            if charge and user_id is not None:
+                self._take_token(user_id, now)
+            if len(self.queue) >= SCHED_MAX_QUEUE:
+                self.counts["overloaded"] += 1
+                raise Overloaded("Too many requests waiting for OpenAI", retry_after=1)
+            flow = (channel, user_id)
+            weight = self.weights.get(channel, 1.0)
+            finish = max(self.virtual_time, self.last_finish.get(flow, 0.0)) + 1.0 / weight
+            self.last_finish[flow] = finish
+            if len(self.last_finish) > 10000:
+                # Flows that finished before the virtual clock carry no state
+                self.last_finish = {f: t for f, t in self.last_finish.items() if t > self.virtual_time}
+            ticket = Ticket(finish, next(self.seq), flow, loop)
+            ticket.probe = probe
+            heapq.heappush(self.queue, ticket)
+            self.counts["admitted"] += 1
+            self._dispatch()
+        return ticket
+
+    def _take_token(self, user_id, now) -> None:
+        # Caller holds self.lock
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            if len(self.buckets) > 10000:
+                full = now - SCHED_USER_BURST / SCHED_USER_RATE
+                self.buckets = {u: b for u, b in self.buckets.items() if b[1] > full}
+            bucket = self.buckets[user_id] = [SCHED_USER_BURST, now]
+        bucket[0] = min(SCHED_USER_BURST, bucket[0] + (now - bucket[1]) * SCHED_USER_RATE)
+        bucket[1] = now
+        if bucket[0] < 1:
+            self.counts["rate_limited"] += 1
+            raise RateLimited("Too many messages, slow down", retry_after=(1 - bucket[0]) / SCHED_USER_RATE)
+        bucket[0] -= 1
+
+    def _dispatch(self) -> None:
+        # Caller holds self.lock
+        while self.queue and self.in_flight < int(self.limit):
+            ticket = heapq.heappop(self.queue)
+            if ticket.cancelled:
+                continue
+            self.virtual_time = ticket.finish
+            self.in_flight += 1
+            ticket.grant()
+
+    def _wait(self, ticket) -> None:
+        if ticket.event.wait(SCHED_QUEUE_TIMEOUT):
+            return
+        self._abandon(ticket)
+
+    async def _await(self, ticket) -> None:
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), SCHED_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._abandon(ticket)
+        except asyncio.CancelledError:
+            with self.lock:
+                granted = ticket.granted
+                ticket.cancelled = True
+                if not granted and ticket.probe:
+                    # Let the next request probe instead
+                    self.probing = False
+            if granted:
+                self._cancelled(ticket)
+            raise
+
+    def _abandon(self, ticket) -> None:
+        with self.lock:
+            if ticket.granted:
+                return
+            ticket.cancelled = True
+            if ticket.probe:
+                self.probing = False
+            self.counts["overloaded"] += 1
+        raise Overloaded("Timed out waiting for an OpenAI slot", retry_after=1)
+
+    def _release(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def _cancelled(self, ticket) -> None:
+        # A granted slot given up without an outcome (cancelled task)
+        with self.lock:
+            self.in_flight -= 1
+            if ticket.probe:
+                self.probing = False
+            self._dispatch()
+
+    # -- outcomes ------------------------------------------------------------
+
+    def _succeeded(self, ticket, headers) -> None:
+        with self.lock:
+            self.failures = 0
+            if ticket.probe or self.state == HALF_OPEN:
+                self.state = CLOSED
+                self.probing = False
+            self._adapt(headers)
+
+    def _failed(self, ticket, error, attempt) -> float:
+        # Releases the slot and returns the delay before the next attempt,
+        # or raises if the error is not worth retrying.
+        status = getattr(error, "status_code", None)
+        retryable = (
+            isinstance(error, (openai.APIConnectionError, openai.APITimeoutError))
+            or status == 429
+            or (status is not None and status >= 500)
+        )
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        with self.lock:
+            self.in_flight -= 1
+            if ticket.probe:
+                self.probing = False
+            if retryable:
+                self.counts["upstream_errors"] += 1
+                self.failures += 1
+                if status == 429:
+                    # Multiplicative decrease
+                    self.limit = max(SCHED_MIN_CONCURRENCY, self.limit / 2)
+                if ticket.probe or self.failures >= SCHED_BREAKER_THRESHOLD:
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+            self._dispatch()
+        if not retryable:
+            raise error
+        wait = retry_after(headers, rate_limited=status == 429)
+        if attempt >= SCHED_MAX_RETRIES:
+            if status == 429:
+                raise RateLimited("OpenAI rate limit reached", retry_after=wait) from error
+            raise error
+        if wait is not None and wait > SCHED_BACKOFF_MAX:
+            # Too long to hold the request; the client can come back later
+            raise RateLimited("OpenAI asked to retry later", retry_after=wait) from error
+        with self.lock:
+            self.counts["retries"] += 1
+        delay = random.uniform(0, min(SCHED_BACKOFF_MAX, SCHED_BACKOFF_BASE * 2 ** attempt))
+        return max(delay, wait or 0.0)
+
+    def _check_breaker(self, now) -> bool:
+        # Caller holds self.lock. Returns True if this request is the
+        # half-open probe that decides whether to close the breaker.
+        if self.state == CLOSED:
+            return False
+        remaining = self.opened_at + SCHED_BREAKER_COOLDOWN - now
+        if self.state == OPEN and remaining <= 0:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        self.counts["circuit_open"] += 1
+        raise CircuitOpen("OpenAI is unavailable, try again later", retry_after=max(remaining, 1))
+
+    def _adapt(self, headers) -> None:
+        # Caller holds self.lock. Additive increase while there is headroom
+        # in the account limits, multiplicative decrease when it runs low.
+        fractions = []
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            try:
+                if remaining is not None and limit is not None and float(limit) > 0:
+                    fractions.append(float(remaining) / float(limit))
+            except ValueError:
+                pass
+        if fractions and min(fractions) < SCHED_LOW_WATERMARK:
+            self.limit = max(SCHED_MIN_CONCURRENCY, self.limit * 0.75)
+        else:
+            self.limit = min(SCHED_MAX_CONCURRENCY, self.limit + 1.0 / self.limit)
+
+
+def retry_after(headers, rate_limited: bool = False) -> float:
+    # Seconds the server asked us to wait, if it said. The request limit's
+    # reset time only says when to retry a 429.
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    reset = headers.get("x-ratelimit-reset-requests")
+    if reset and rate_limited:
+        return parse_reset(reset)
+    return None
+
+
+scheduler = Scheduler()
@@ -1,2 +1,13 @@
 #!/bin/bash
-gunicorn -w 4 -b 0.0.0.0:10000 chat_gpt:app
+# SERVER_MODE=asgi serves asgi:app on uvicorn workers (native async, shared
+# AsyncOpenAI client); the default is the Flask app on sync workers.
+WORKERS=${WEB_CONCURRENCY:-4}
+BIND=0.0.0.0:${PORT:-10000}
+# Workers write metrics snapshots here for /metrics; start each deploy clean
+export METRICS_DIR=${METRICS_DIR:-/tmp/chatbot-metrics}
+mkdir -p "$METRICS_DIR" && rm -f "${METRICS_DIR:?}"/*.json
+if [ "$SERVER_MODE" = "asgi" ]; then
+    exec gunicorn -w "$WORKERS" -k uvicorn.workers.UvicornWorker -b "$BIND" asgi:app
+else
+    exec gunicorn -w "$WORKERS" -b "$BIND" chat_gpt:app
+fi
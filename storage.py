@@ -0,0 +1,302 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Database settings
+DB_PATH = os.getenv("CHATBOT_DB", "chatbot.db")
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5.0"))  # seconds
+
+# Write-behind: chat turns are queued and a background thread inserts them
+# in one transaction every DB_WRITE_INTERVAL seconds (or DB_WRITE_BATCH rows).
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "1") == "1"
+DB_WRITE_INTERVAL = float(os.getenv("DB_WRITE_INTERVAL", "0.005"))
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "200"))
+# A batch that still hits "database is locked" after the busy timeout is
+# retried this many times before falling back to one row at a time.
+DB_WRITE_ATTEMPTS = int(os.getenv("DB_WRITE_ATTEMPTS", "3"))
+DB_WRITE_RETRY_DELAY = float(os.getenv("DB_WRITE_RETRY_DELAY", "0.1"))  # seconds, doubled per retry
+
+INSERT_CONVERSATION = (
+    "INSERT INTO conversations (user_id, user_message, bot_response, model, prompt_tokens, "
+    "completion_tokens, upstream_latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Per-turn usage, added to databases created before it was recorded
+USAGE_COLUMNS = (
+    ("model", "TEXT"),
+    ("prompt_tokens", "INTEGER"),
+    ("completion_tokens", "INTEGER"),
+    ("upstream_latency_ms", "REAL"),
+)
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+    # WAL lets readers run alongside the single writer, and with
+    # synchronous=NORMAL a commit no longer waits on fsync.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    # One connection per thread (and per process, since gunicorn forks).
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def init_db() -> None:
+    conn = get_connection()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            user_message TEXT NOT NULL,
+            bot_response TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+    for column, column_type in USAGE_COLUMNS:
+        if column not in columns:
+            try:
+                conn.execute(f"ALTER TABLE conversations ADD COLUMN {column} {column_type}")
+            except sqlite3.OperationalError as e:
+                # Another worker added it first
+                if "duplicate column" not in str(e):
+                    raise
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp
+        ON conversations (user_id, timestamp)
+    """)
+    # History pages are walked backwards by id (keyset pagination)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_user_id_id
+        ON conversations (user_id, id)
+    """)
+    # Shared tier of the response cache (see cache.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    # Telegram update_ids already accepted by any worker (see telegram_queue.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS telegram_updates (
+            update_id INTEGER PRIMARY KEY,
+            received_at REAL NOT NULL
+        )
+    """)
+    # Rolling summary of turns that no longer fit the context budget (see context.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS context_summaries (
+            user_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+class WriteBehindWriter:
+    # Background thread that groups queued inserts into one transaction.
+
+    def __init__(self, interval: float = DB_WRITE_INTERVAL, batch_size: int = DB_WRITE_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        # Threads do not survive fork, so each gunicorn worker starts its own.
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.queue = queue.Queue()
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self.thread.start()
+
+    def submit(self, sql: str, params: tuple) -> None:
+        self.start()
+        self.queue.put((sql, params))
+
+    def flush(self, timeout: float = 5.0) -> None:
+        # Waits until everything queued so far has been committed.
+        if self.thread is None or self.pid != os.getpid():
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get(timeout=self.interval))
+            except queue.Empty:
+                pass
+            self._write(batch)
+
+    def _write(self, batch: list) -> None:
+        rows = [item for item in batch if not isinstance(item, threading.Event)]
+        if rows:
+            started = time.perf_counter()
+            if self._commit(rows, DB_WRITE_ATTEMPTS) is None:
+                metrics.observe("chatbot_stage_seconds", time.perf_counter() - started, {"stage": "db_write"})
+            else:
+                self._write_rows(rows)
+        for item in batch:
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _write_rows(self, rows: list) -> None:
+        # One transaction per row, so a bad row cannot take the batch with it
+        for i, row in enumerate(rows):
+            error = self._commit([row], 1)
+            if error is None:
+                continue
+            if isinstance(error, sqlite3.OperationalError):
+                # Still locked; every remaining row would wait out the busy timeout
+                print(f"Database write error ({len(rows) - i} rows lost): {error}")
+                return
+            print(f"Database write error (1 row lost): {error}")
+
+    def _commit(self, rows: list, attempts: int):
+        # Returns None on success, or the last error
+        conn = get_connection()
+        for attempt in range(attempts):
+            try:
+                with conn:
+                    for sql, params in rows:
+                        conn.execute(sql, params)
+                return None
+            except sqlite3.OperationalError as e:
+                error = e
+                if attempt + 1 < attempts:
+                    time.sleep(DB_WRITE_RETRY_DELAY * 2 ** attempt)
+            except Exception as e:
+                return e
+        return error
+
+
+writer = WriteBehindWriter()
+atexit.register(writer.flush)
+
+
+def execute_write(sql: str, params: tuple) -> None:
+    if DB_WRITE_BEHIND:
+        writer.submit(sql, params)
+        return
+    with metrics.stage("db_write"):
+        conn = get_connection()
+        with conn:
+            conn.execute(sql, params)
+
+
+def save_conversation(user_id: str, user_message: str, bot_response: str, model: str = None,
+                      prompt_tokens: int = None, completion_tokens: int = None,
+                      upstream_latency_ms: float = None) -> None:
+    execute_write(
+        INSERT_CONVERSATION,
+        (user_id, user_message, bot_response, model, prompt_tokens, completion_tokens, upstream_latency_ms)
+    )
+
+
+def fetch_history(user_id: str, limit: int, before: int = None):
+    # Newest first, at most `limit` rows older than the id `before`.
+    # Returns the cursor so callers can stream rows instead of fetchall().
+    if before is None:
+        return get_connection().execute(
+            "SELECT id, user_message, bot_response, timestamp FROM conversations "
+            "WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, limit)
+        )
+    return get_connection().execute(
+        "SELECT id, user_message, bot_response, timestamp FROM conversations "
+        "WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+        (user_id, before, limit)
+    )
+
+
+def latest_history_id(user_id: str, before: int = None):
+    # Conversations are append-only, so the newest id visible to a page is
+    # enough to tell whether that page has changed.
+    if before is None:
+        row = get_connection().execute(
+            "SELECT MAX(id) FROM conversations WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+    else:
+        row = get_connection().execute(
+            "SELECT MAX(id) FROM conversations WHERE user_id = ? AND id < ?",
+            (user_id, before)
+        ).fetchone()
+    return row[0]
+
+
+def get_cached_response(key: str, now: float):
+    row = get_connection().execute(
+        "SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+        (key, now)
+    ).fetchone()
+    return row
+
+
+def put_cached_response(key: str, response: str, expires_at: float) -> None:
+    execute_write(
+        "INSERT OR REPLACE INTO response_cache (key, response, expires_at) VALUES (?, ?, ?)",
+        (key, response, expires_at)
+    )
+
+
+def prune_response_cache(now: float) -> None:
+    execute_write("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+
+
+def claim_telegram_update(update_id: int, now: float) -> bool:
+    # True if this worker is the first to see the update. Written directly,
+    # not behind, because the answer is needed before acknowledging.
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO telegram_updates (update_id, received_at) VALUES (?, ?)",
+            (update_id, now)
+        )
+    return cursor.rowcount == 1
+
+
+def prune_telegram_updates(older_than: float) -> None:
+    execute_write("DELETE FROM telegram_updates WHERE received_at < ?", (older_than,))
+
+
+def load_summary(user_id: str):
+    row = get_connection().execute(
+        "SELECT summary FROM context_summaries WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def save_summary(user_id: str, summary: str) -> None:
+    execute_write(
+        "INSERT OR REPLACE INTO context_summaries (user_id, summary) VALUES (?, ?)",
+        (user_id, summary)
+    )
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import storage
+
+# Telegram update queue settings
+TELEGRAM_QUEUE_MAX = int(os.getenv("TELEGRAM_QUEUE_MAX", "1000"))  # pending updates per worker
+TELEGRAM_WORKERS = int(os.getenv("TELEGRAM_WORKERS", "64"))  # chats processed in parallel
+TELEGRAM_DEDUP_SIZE = int(os.getenv("TELEGRAM_DEDUP_SIZE", "10000"))
+# Redeliveries may reach another gunicorn worker, so update_ids are also
+# claimed in SQLite. Telegram keeps undelivered updates for 24 hours.
+TELEGRAM_DEDUP_SHARED = os.getenv("TELEGRAM_DEDUP_SHARED", "1") == "1"
+TELEGRAM_DEDUP_TTL = 24 * 60 * 60  # seconds
+TELEGRAM_DEDUP_PRUNE_INTERVAL = 600  # seconds
+
+QUEUED = "queued"
+DUPLICATE = "duplicate"
+OVERLOADED = "overloaded"
+
+
+class UpdateQueue:
+    # Processes updates in order within a chat and in parallel across chats.
+    # The webhook only submits and returns; handlers run on a background
+    # event loop (the ASGI app's loop, or a dedicated thread under WSGI).
+    #
+    # The order only holds within one worker process. With several gunicorn
+    # workers, two updates from the same chat can reach different workers
+    # and be handled at the same time, each with the context it has seen so
+    # far. Deduplication is shared (SQLite), ordering is not; run a single
+    # worker where strict per-chat ordering matters.
+
+    def __init__(self, handler, max_pending: int = TELEGRAM_QUEUE_MAX, workers: int = TELEGRAM_WORKERS,
+                 dedup_size: int = TELEGRAM_DEDUP_SIZE, dedup_shared: bool = TELEGRAM_DEDUP_SHARED):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.workers = workers
+        self.dedup_size = dedup_size
+        self.dedup_shared = dedup_shared
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.seen = OrderedDict()  # recent update_ids
+        self.chats = {}  # chat_id -> deque of updates, touched only on self.loop
+        self.slots = None
+        self.loop = None
+        self.pid = None
+        self.last_prune = 0.0
+
+    def attach(self, loop) -> None:
+        # ASGI mode: run handlers on the application's own event loop
+        with self.lock:
+            self._reset(loop)
+
+    def submit(self, update) -> str:
+        self._ensure_loop()
+        update_id = update.update_id
+        with self.lock:
+            if update_id in self.seen:
+                return DUPLICATE
+            if self.pending >= self.max_pending:
+                return OVERLOADED
+            self._remember(update_id)
+            self.pending += 1
+        if self.dedup_shared and not self._claim(update_id):
+            with self.lock:
+                self.pending -= 1
+            return DUPLICATE
+        self.loop.call_soon_threadsafe(self._enqueue, update)
+        return QUEUED
+
+    def _claim(self, update_id: int) -> bool:
+        now = time.time()
+        try:
+            if now - self.last_prune >= TELEGRAM_DEDUP_PRUNE_INTERVAL:
+                self.last_prune = now
+                storage.prune_telegram_updates(now - TELEGRAM_DEDUP_TTL)
+            return storage.claim_telegram_update(update_id, now)
+        except Exception as e:
+            # Better to risk a duplicate reply than to drop the update
+            print(f"Telegram dedup error: {e}")
+            return True
+
+    def _remember(self, update_id: int) -> None:
+        # Caller holds self.lock
+        self.seen[update_id] = None
+        while len(self.seen) > self.dedup_size:
+            self.seen.popitem(last=False)
+
+    def _ensure_loop(self) -> None:
+        # WSGI mode: each request runs in a short-lived loop, so updates are
+        # processed on a loop thread of our own (one per forked worker).
+        with self.lock:
+            if self.loop is not None and self.pid == os.getpid():
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="telegram-updates", daemon=True).start()
+            self._reset(loop)
+
+    def _reset(self, loop) -> None:
+        # Caller holds self.lock
+        self.loop = loop
+        self.pid = os.getpid()
+        self.pending = 0
+        self.chats = {}
+        self.slots = asyncio.Semaphore(self.workers)
+
+    def _enqueue(self, update) -> None:
+        chat = update.effective_chat
+        chat_id = chat.id if chat is not None else None
+        updates = self.chats.get(chat_id)
+        if updates is not None:
+            # A task is already draining this chat; keep the order
+            updates.append(update)
+            return
+        self.chats[chat_id] = deque([update])
+        self.loop.create_task(self._drain(chat_id))
+
+    async def _drain(self, chat_id) -> None:
+        updates = self.chats[chat_id]
+        async with self.slots:
+            while updates:
+                update = updates.popleft()
+                try:
+                    await self.handler(update, None)
+                except Exception as e:
+                    print(f"Error processing update {update.update_id}: {e}")
+                finally:
+                    with self.lock:
+                        self.pending -= 1
+        del self.chats[chat_id]
@@ -0,0 +1,19 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the tests away from the real database, metrics directory and APIs
+_tmp = tempfile.mkdtemp(prefix="chatbot-tests-")
+atexit.register(shutil.rmtree, _tmp, ignore_errors=True)
+os.environ["CHATBOT_DB"] = os.path.join(_tmp, "chatbot.db")
+os.environ["METRICS_DIR"] = os.path.join(_tmp, "metrics")
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["TELEGRAM_BOT_TOKEN"] = "123456:test"
+
+import storage  # noqa: E402  (reads CHATBOT_DB at import)
+
+storage.init_db()
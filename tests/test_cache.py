@@ -0,0 +1,46 @@
+import time
+
+import storage
+from cache import ResponseCache, cache_key
+
+
+def key(text):
+    return cache_key("gpt-3.5-turbo", [{"role": "user", "content": text}], 150, 0.7)
+
+
+def test_prompts_are_normalized():
+    assert key("Γεια σου!") == key("  γεια   σου! ")
+    assert key("Γεια σου!") != key("Γεια σας!")
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(ttl=60, max_entries=2, shared=False)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (2, 1, 1, 2)
+
+
+def test_expired_entry_is_a_miss():
+    cache = ResponseCache(ttl=0.05, max_entries=10, shared=False)
+    cache.put("a", "A")
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["expirations"], stats["misses"], stats["entries"]) == (1, 1, 0)
+
+
+def test_other_workers_hit_the_shared_tier():
+    writer_cache = ResponseCache(ttl=60, max_entries=10, shared=True)
+    reader_cache = ResponseCache(ttl=60, max_entries=10, shared=True)
+    writer_cache.put("shared-key", "Γεια σου!")
+    storage.writer.flush()
+    assert reader_cache.get("shared-key") == "Γεια σου!"
+    # Now held in the reader's own LRU
+    assert reader_cache.get("shared-key") == "Γεια σου!"
+    stats = reader_cache.stats()
+    assert (stats["shared_hits"], stats["hits"], stats["misses"]) == (1, 1, 0)
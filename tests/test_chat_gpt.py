@@ -0,0 +1,143 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import chat_gpt
+from context import ContextCache
+from scheduler import Scheduler
+
+REPLY = ("Γεια", " σου")
+
+
+def chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None, model="test")
+
+
+class FakeRawResponse:
+
+    def __init__(self, parsed):
+        self.headers = {}
+        self.parsed = parsed
+
+    def parse(self):
+        return self.parsed
+
+
+class FakeCompletions:
+    # Stands in for the sync client's chat.completions.with_raw_response
+
+    def create(self, **kwargs):
+        def chunks():
+            for word in REPLY:
+                time.sleep(0.01)
+                yield chunk(word)
+        return FakeRawResponse(chunks())
+
+
+@pytest.fixture
+def sync_openai(monkeypatch):
+    # WSGI mode: the sync client and a scheduler with a single slot
+    sched = Scheduler()
+    sched.limit = 1
+    monkeypatch.setattr(chat_gpt, "client", SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(with_raw_response=FakeCompletions()))))
+    monkeypatch.setattr(chat_gpt, "async_client", None)
+    monkeypatch.setattr(chat_gpt, "scheduler", sched)
+    monkeypatch.setattr(chat_gpt, "context_cache", None)
+    monkeypatch.setattr(chat_gpt, "response_cache", None)
+    return sched
+
+
+def test_sync_streams_finish_with_more_chats_than_executor_threads(sync_openai):
+    # Chats waiting for a slot must not hold the executor threads that the
+    # chat holding the slot needs to read its stream
+    async def reply(i):
+        return "".join([delta async for delta in chat_gpt.astream_chat_with_gpt("Γεια", f"user_{i}", "telegram")])
+
+    async def main():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+        return await asyncio.wait_for(asyncio.gather(*(reply(i) for i in range(8))), 10)
+
+    assert asyncio.run(main()) == ["".join(REPLY)] * 8
+    assert sync_openai.stats()["in_flight"] == 0
+
+
+class FakeMessage:
+    # A Telegram message whose edits take edit_delay seconds
+    def __init__(self, edit_delay=0.0, fail_previews=False):
+        self.edit_delay = edit_delay
+        self.fail_previews = fail_previews
+        self.edits = []
+
+    async def reply_text(self, text):
+        return self
+
+    async def edit_text(self, text):
+        await asyncio.sleep(self.edit_delay)
+        if self.fail_previews and text.endswith(chat_gpt.TELEGRAM_PLACEHOLDER):
+            raise RuntimeError("Flood control exceeded")
+        self.edits.append(text)
+
+
+@pytest.fixture
+def fake_stream(monkeypatch):
+    # Replaces the completion stream with 20 quick deltas
+    state = {"finished_at": None}
+
+    async def stream(user_input, user_id=None, channel="web", usage=None):
+        for i in range(20):
+            await asyncio.sleep(0.01)
+            yield f"w{i} "
+        state["finished_at"] = time.monotonic()
+
+    monkeypatch.setattr(chat_gpt, "astream_chat_with_gpt", stream)
+    monkeypatch.setattr(chat_gpt, "TELEGRAM_EDIT_INTERVAL", 0.05)
+    return state
+
+
+def full_reply():
+    return " ".join(f"w{i}" for i in range(20))
+
+
+def test_slow_telegram_edits_do_not_hold_up_the_stream(fake_stream):
+    message = FakeMessage(edit_delay=0.3)
+
+    async def main():
+        started = time.monotonic()
+        text = await chat_gpt.stream_telegram_reply(SimpleNamespace(message=message), "1", "Γεια")
+        return text, fake_stream["finished_at"] - started
+
+    text, stream_time = asyncio.run(main())
+    assert text == full_reply()
+    assert stream_time < 0.3
+    assert message.edits[-1] == full_reply()
+
+
+def test_failed_preview_edits_keep_the_reply(fake_stream):
+    message = FakeMessage(fail_previews=True)
+    text = asyncio.run(chat_gpt.stream_telegram_reply(SimpleNamespace(message=message), "1", "Γεια"))
+    assert text == full_reply()
+    assert message.edits == [full_reply()]
+
+
+def test_replies_with_history_are_not_cached(monkeypatch):
+    cache = ContextCache(lambda summary, turns: summary)
+    monkeypatch.setattr(chat_gpt, "context_cache", cache)
+    assert chat_gpt.completion_request("Γεια", "cache-user")[1] is not None
+    cache.record_turn("cache-user", "Γεια", "Γεια σου!")
+    messages, key = chat_gpt.completion_request("Γεια", "cache-user")
+    assert len(messages) == 3
+    assert key is None
+
+
+def test_anonymous_callers_share_no_context(monkeypatch):
+    cache = ContextCache(lambda summary, turns: summary)
+    monkeypatch.setattr(chat_gpt, "context_cache", cache)
+    chat_gpt.record_turn(chat_gpt.ANONYMOUS_USER, "Με λένε Μαρία", "Γεια σου Μαρία!")
+    messages, key = chat_gpt.completion_request("Πώς με λένε;", chat_gpt.ANONYMOUS_USER)
+    assert messages == [{"role": "user", "content": "Πώς με λένε;"}]
+    assert key is not None
+    assert chat_gpt.ANONYMOUS_USER not in cache.contexts
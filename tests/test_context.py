@@ -0,0 +1,49 @@
+import time
+
+import context
+import storage
+from context import ContextCache
+
+
+def wait_summarized(ctx, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while ctx.summarizing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not ctx.summarizing
+
+
+def test_failed_summary_keeps_the_overflow_turns(monkeypatch):
+    monkeypatch.setattr(context, "CONTEXT_TOKEN_BUDGET", 10)
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append(list(turns))
+        if len(calls) == 1:
+            raise RuntimeError("OpenAI is unavailable")
+        return "σύνοψη"
+
+    cache = ContextCache(summarize)
+    cache.record_turn("summary-user", "πρώτο μήνυμα " * 5, "πρώτη απάντηση " * 5)
+    cache.record_turn("summary-user", "δεύτερο μήνυμα " * 5, "δεύτερη απάντηση " * 5)
+    ctx = cache._get("summary-user")
+    wait_summarized(ctx)
+    assert ctx.overflow == calls[0]
+
+    # The next turn retries with the kept turns first
+    cache.record_turn("summary-user", "τρίτο μήνυμα " * 5, "τρίτη απάντηση " * 5)
+    wait_summarized(ctx)
+    assert calls[1][:len(calls[0])] == calls[0]
+    assert ctx.summary == "σύνοψη"
+    assert ctx.overflow == []
+
+
+def test_error_fallbacks_are_left_out_of_the_context():
+    error = "Συγγνώμη, προέκυψε ένα σφάλμα."
+    storage.save_conversation("fallback-user", "Γεια", "Γεια σου!")
+    storage.save_conversation("fallback-user", "Τι κάνεις;", error)
+    storage.writer.flush()
+
+    cache = ContextCache(lambda summary, turns: summary, skip_responses=(error,))
+    cache.record_turn("fallback-user", "Και τώρα;", error)
+    messages = cache.messages("fallback-user", "Και τώρα;")
+    assert [m["content"] for m in messages] == ["Γεια", "Γεια σου!", "Και τώρα;"]
@@ -0,0 +1,39 @@
+import pytest
+
+import chat_gpt
+import storage
+
+
+@pytest.fixture(scope="module")
+def client():
+    for i in range(5):
+        storage.save_conversation("history-user", f"μήνυμα {i}", f"απάντηση {i}")
+    storage.writer.flush()
+    return chat_gpt.app.test_client()
+
+
+def test_pages_walk_back_by_id(client):
+    first = client.get("/history/history-user?limit=2").get_json()
+    assert [row["user"] for row in first] == ["μήνυμα 4", "μήνυμα 3"]
+    second = client.get(f"/history/history-user?limit=2&before={first[-1]['id']}").get_json()
+    assert [row["user"] for row in second] == ["μήνυμα 2", "μήνυμα 1"]
+
+
+def test_unchanged_page_is_not_modified(client):
+    response = client.get("/history/history-user?limit=2")
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    again = client.get("/history/history-user?limit=2", headers={"If-None-Match": response.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_cache_control_of_older_pages(client):
+    newest = client.get("/history/history-user?limit=1").get_json()[0]["id"]
+    assert client.get(f"/history/history-user?before={newest}").headers["Cache-Control"] == "private, max-age=86400"
+    # Rows written later can still land below an id past the newest one
+    assert client.get(f"/history/history-user?before={newest + 1000}").headers["Cache-Control"] == "private, no-cache"
+
+
+@pytest.mark.parametrize("query", ["limit=abc", "limit=0", "before=abc"])
+def test_bad_query_is_rejected(client, query):
+    response = client.get(f"/history/history-user?{query}")
+    assert response.status_code == 400
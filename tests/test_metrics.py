@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import metrics
+
+
+def write_snapshot(directory, pid, registry):
+    snapshot = registry.snapshot()
+    snapshot["pid"] = pid
+    with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+        json.dump(snapshot, f)
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "registry", metrics.Registry())
+    return metrics.registry
+
+
+def test_render_sums_worker_snapshots(registry, tmp_path):
+    registry.inc("chatbot_requests_total", {"route": "/chat", "status": "200"})
+    registry.observe("chatbot_stage_seconds", 0.02, {"stage": "openai"})
+
+    other = metrics.Registry()
+    other.inc("chatbot_requests_total", {"route": "/chat", "status": "200"}, 2)
+    other.observe("chatbot_stage_seconds", 3.0, {"stage": "openai"})
+    write_snapshot(tmp_path, os.getppid(), other)
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE chatbot_requests_total counter" in lines
+    assert 'chatbot_requests_total{route="/chat",status="200"} 3' in lines
+    assert 'chatbot_stage_seconds_bucket{stage="openai",le="0.025"} 1' in lines
+    assert 'chatbot_stage_seconds_bucket{stage="openai",le="5"} 2' in lines
+    assert 'chatbot_stage_seconds_bucket{stage="openai",le="+Inf"} 2' in lines
+    assert 'chatbot_stage_seconds_count{stage="openai"} 2' in lines
+    assert 'chatbot_stage_seconds_sum{stage="openai"} 3.02' in lines
+
+
+def test_exited_workers_keep_counters_but_not_gauges(registry, tmp_path):
+    exited = metrics.Registry()
+    exited.inc("chatbot_upstream_failures_total", value=4)
+    exited.inc("chatbot_requests_in_flight", {"route": "/chat"}, 7)
+    write_snapshot(tmp_path, dead_pid(), exited)
+
+    text = metrics.render()
+    assert "chatbot_upstream_failures_total 4" in text.splitlines()
+    assert "chatbot_requests_in_flight" not in text
+
+
+def test_collectors_are_read_at_render_time(registry):
+    pending = {"value": 1}
+    registry.add_collector(lambda: [("chatbot_telegram_queue_pending", None, pending["value"])])
+    assert "chatbot_telegram_queue_pending 1" in metrics.render().splitlines()
+    pending["value"] = 5
+    assert "chatbot_telegram_queue_pending 5" in metrics.render().splitlines()
+
+
+def test_label_values_are_escaped(registry):
+    registry.inc("chatbot_requests_total", {"route": 'a"b\\c', "status": "200"})
+    assert 'chatbot_requests_total{route="a\\"b\\\\c",status="200"} 1' in metrics.render().splitlines()
@@ -0,0 +1,184 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import scheduler as scheduler_module
+from scheduler import SCHED_BACKOFF_MAX, SCHED_USER_BURST, CircuitOpen, Overloaded, RateLimited, Scheduler
+
+
+class FakeRawResponse:
+
+    def __init__(self, parsed="ok", headers=None):
+        self.headers = headers or {}
+        self.parsed = parsed
+
+    def parse(self):
+        return self.parsed
+
+
+def api_error(status, headers):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    error_class = openai.RateLimitError if status == 429 else openai.InternalServerError
+    return error_class("upstream error", response=response, body=None)
+
+
+@pytest.fixture
+def sched():
+    return Scheduler()
+
+
+def test_cancelled_create_releases_the_slot(sched):
+    sched.limit = 1
+    started = asyncio.Event()
+
+    async def slow_create():
+        started.set()
+        await asyncio.sleep(10)
+
+    async def fast_create():
+        return FakeRawResponse()
+
+    async def call(create):
+        async with sched.acall(create, "user", "web") as result:
+            return result
+
+    async def main():
+        task = asyncio.create_task(call(slow_create))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert sched.stats()["in_flight"] == 0
+        # The single slot is free for the next call
+        return await asyncio.wait_for(call(fast_create), 1)
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_server_error_ignores_the_request_limit_reset(sched):
+    ticket = sched._admit("user", "web")
+    delay = sched._failed(ticket, api_error(500, {"x-ratelimit-reset-requests": "6m0s"}), 0)
+    assert delay <= SCHED_BACKOFF_MAX
+    assert sched.stats()["in_flight"] == 0
+
+
+def test_long_retry_after_fails_fast(sched):
+    ticket = sched._admit("user", "web")
+    with pytest.raises(RateLimited) as raised:
+        sched._failed(ticket, api_error(429, {"retry-after": "120"}), 0)
+    assert raised.value.retry_after == 120
+    assert sched.stats()["in_flight"] == 0
+
+
+def test_short_retry_after_is_honoured(sched):
+    ticket = sched._admit("user", "web")
+    delay = sched._failed(ticket, api_error(429, {"x-ratelimit-reset-requests": "6s"}), 0)
+    assert delay >= 6
+
+
+def test_user_rate_limit(sched):
+    for _ in range(int(SCHED_USER_BURST)):
+        with sched.call(FakeRawResponse, "user", "web"):
+            pass
+    with pytest.raises(RateLimited) as raised:
+        with sched.call(FakeRawResponse, "user", "web"):
+            pass
+    assert raised.value.retry_after > 0
+    # Other users are not affected
+    with sched.call(FakeRawResponse, "other", "web") as result:
+        assert result == "ok"
+
+
+def test_full_queue_is_overloaded(sched, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "SCHED_MAX_QUEUE", 1)
+    sched.limit = 1
+    assert sched._admit("a", "web").granted
+    assert not sched._admit("b", "web").granted
+    with pytest.raises(Overloaded):
+        sched._admit("c", "web")
+
+
+def test_fair_queuing_across_users(sched):
+    # A user with a backlog does not hold up another user's single request
+    sched.limit = 1
+    first = sched._admit("a", "web")
+    a_tickets = [sched._admit("a", "web") for _ in range(3)]
+    b_ticket = sched._admit("b", "web")
+    assert first.granted
+    sched._release()
+    assert a_tickets[0].granted
+    sched._release()
+    assert b_ticket.granted
+    assert not a_tickets[1].granted
+
+
+def test_sync_call_retries_transient_errors(sched, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "SCHED_BACKOFF_BASE", 0.001)
+    errors = [api_error(500, {}), api_error(503, {})]
+
+    def create():
+        if errors:
+            raise errors.pop(0)
+        return FakeRawResponse()
+
+    with sched.call(create, "user", "web") as result:
+        assert result == "ok"
+    stats = sched.stats()
+    assert stats["retries"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_breaker_opens_and_closes_after_a_probe(sched, monkeypatch):
+    for _ in range(scheduler_module.SCHED_BREAKER_THRESHOLD):
+        sched._failed(sched._admit(None, "web"), api_error(500, {}), 0)
+    assert sched.stats()["state"] == "open"
+    with pytest.raises(CircuitOpen):
+        sched._admit(None, "web")
+
+    monkeypatch.setattr(scheduler_module, "SCHED_BREAKER_COOLDOWN", 0)
+    probe = sched._admit(None, "web")
+    assert probe.probe
+    with pytest.raises(CircuitOpen):
+        sched._admit(None, "web")
+    sched._succeeded(probe, {})
+    sched._release()
+    assert sched.stats()["state"] == "closed"
+
+
+def test_cancelled_queued_probe_lets_another_request_probe(sched, monkeypatch):
+    for _ in range(scheduler_module.SCHED_BREAKER_THRESHOLD):
+        sched._failed(sched._admit(None, "web"), api_error(500, {}), 0)
+    monkeypatch.setattr(scheduler_module, "SCHED_BREAKER_COOLDOWN", 0)
+    sched.limit = 1
+    sched.in_flight = 1  # the only slot is taken
+
+    async def call():
+        async with sched.acall(lambda: None, None, "web"):
+            pass
+
+    async def main():
+        task = asyncio.create_task(call())
+        await asyncio.sleep(0.01)
+        assert sched.probing
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    sched._release()
+    assert not sched.probing
+    assert sched._admit(None, "web").probe
+
+
+def test_limit_adapts_to_rate_limit_headers(sched):
+    limit = sched.limit
+    sched._succeeded(sched._admit(None, "web"), {"x-ratelimit-limit-requests": "100",
+                                                 "x-ratelimit-remaining-requests": "90"})
+    assert sched.limit > limit
+    limit = sched.limit
+    sched._succeeded(sched._admit(None, "web"), {"x-ratelimit-limit-requests": "100",
+                                                 "x-ratelimit-remaining-requests": "1"})
+    assert sched.limit < limit
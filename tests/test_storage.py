@@ -0,0 +1,45 @@
+import sqlite3
+import threading
+
+import pytest
+
+import storage
+from storage import INSERT_CONVERSATION, WriteBehindWriter
+
+
+def conversation(user_id, user_message="Γεια", bot_response="Γεια σου!"):
+    return INSERT_CONVERSATION, (user_id, user_message, bot_response, None, None, None, None)
+
+
+def count_rows(user_id):
+    return storage.get_connection().execute(
+        "SELECT COUNT(*) FROM conversations WHERE user_id = ?", (user_id,)
+    ).fetchone()[0]
+
+
+@pytest.fixture
+def writer():
+    # Blocks on the first row, so the whole test batch is written together
+    w = WriteBehindWriter(interval=0.2)
+    yield w
+    w.flush()
+
+
+def test_bad_row_does_not_drop_the_batch(writer):
+    writer.submit(*conversation("batch-user"))
+    writer.submit(*conversation("batch-user", user_message=None))  # NOT NULL
+    writer.submit(*conversation("batch-user"))
+    writer.flush()
+    assert count_rows("batch-user") == 2
+
+
+def test_locked_batch_is_retried(writer, monkeypatch):
+    monkeypatch.setattr(storage, "DB_BUSY_TIMEOUT", 0.05)
+    locker = sqlite3.connect(storage.DB_PATH, check_same_thread=False)
+    locker.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.35, locker.commit).start()
+    for _ in range(3):
+        writer.submit(*conversation("locked-user"))
+    writer.flush()
+    locker.close()
+    assert count_rows("locked-user") == 3
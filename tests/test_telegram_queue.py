@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from telegram_queue import DUPLICATE, OVERLOADED, QUEUED, UpdateQueue
+
+
+def make_update(update_id, chat_id):
+    return SimpleNamespace(update_id=update_id, effective_chat=SimpleNamespace(id=chat_id))
+
+
+def wait_idle(queue, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while queue.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.pending == 0
+
+
+def test_updates_keep_their_order_within_a_chat():
+    handled = []
+
+    async def handler(update, context):
+        await asyncio.sleep(0.05)
+        handled.append((update.effective_chat.id, update.update_id))
+
+    queue = UpdateQueue(handler, dedup_shared=False)
+    started = time.monotonic()
+    for i in range(15):
+        assert queue.submit(make_update(100 + i, i % 3)) == QUEUED
+    wait_idle(queue)
+    for chat_id in range(3):
+        assert [u for c, u in handled if c == chat_id] == [100 + i for i in range(15) if i % 3 == chat_id]
+    # Chats run in parallel: 5 updates each, not 15 in a row
+    assert time.monotonic() - started < 0.6
+
+
+def test_duplicate_updates_are_dropped():
+    async def handler(update, context):
+        pass
+
+    queue = UpdateQueue(handler, dedup_shared=False)
+    assert queue.submit(make_update(200, 1)) == QUEUED
+    assert queue.submit(make_update(200, 1)) == DUPLICATE
+    wait_idle(queue)
+
+
+def test_redelivery_to_another_worker_is_dropped():
+    async def handler(update, context):
+        pass
+
+    first, second = UpdateQueue(handler), UpdateQueue(handler)
+    assert first.submit(make_update(300, 1)) == QUEUED
+    assert second.submit(make_update(300, 1)) == DUPLICATE
+    wait_idle(first)
+
+
+def test_full_queue_is_overloaded():
+    release = threading.Event()
+
+    async def handler(update, context):
+        await asyncio.to_thread(release.wait, 5)
+
+    queue = UpdateQueue(handler, max_pending=2, dedup_shared=False)
+    assert queue.submit(make_update(400, 1)) == QUEUED
+    assert queue.submit(make_update(401, 2)) == QUEUED
+    assert queue.submit(make_update(402, 3)) == OVERLOADED
+    release.set()
+    wait_idle(queue)
+    # Refused updates are not remembered, so Telegram's redelivery gets in
+    assert queue.submit(make_update(402, 3)) == QUEUED
+    wait_idle(queue)
+
+
+def test_failing_handler_does_not_stall_the_chat():
+    handled = []
+
+    async def handler(update, context):
+        if update.update_id == 500:
+            raise RuntimeError("boom")
+        handled.append(update.update_id)
+
+    queue = UpdateQueue(handler, dedup_shared=False)
+    queue.submit(make_update(500, 1))
+    queue.submit(make_update(501, 1))
+    wait_idle(queue)
+    assert handled == [501]